@@ -1,61 +1,193 @@
 #!/usr/bin/env python3
+"""Summarize benchmark timings, and track them across commits.
+
+By default, this reads hyperfine's `*.bench.json` files (or `brench --json`
+records) and writes a CSV of each mode's metrics and speedup, along with
+a matrix of the speedups between each pair of modes. With
+`--record`, it instead adds the timings to a history file for the current
+commit; with `--check`, it compares them against an earlier commit in the
+history and reports significant slowdowns as JSON, exiting with status 1
+when a gated mode regressed. `--changes` reports every commit in the
+history where a benchmark got significantly slower.
+"""
+import argparse
+import datetime
 import json
 import sys
 import os
 import csv
 import statistics
+import subprocess
 import re
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 
+# The default execution modes, each with a regex for the commands that run
+# it, tried in order. The tables in a turnt or brench config can add modes
+# or change them (see `load_config`).
 MODES = {
     'brili': r'\bbrili\b',
     'brilirs': r'\bbrilirs\b',
     'brilift-jit': r'\bbrilift -j',
-    'brilift-aot': r'^\./[^/]+ '
+    'brilift-aot': r'^\./[^/]+ ',
+    'fastbrili': r'\bfastbrili\b',
+    'brillvm': r'\bbrillvm\b',
 }
 BASELINE = 'brili'
 
+# Modes whose slowdowns count as regressions when checking.
+GATED = ['brilirs', 'brilift-jit', 'brilift-aot']
+
+# A set of modes and the ones among them that are gated.
+Registry = namedtuple('Registry', ['modes', 'gated'])
+DEFAULT_REGISTRY = Registry(MODES, GATED)
+
+# The metrics to report for each benchmark under each mode. Times are in
+# seconds and memory is the peak resident set size in bytes.
+METRICS = ['mean', 'stddev', 'user', 'system', 'memory']
+
+# The config file to load modes from, if it exists.
+DEFAULT_CONFIG = os.path.join(os.path.dirname(__file__), 'turnt.toml')
+
+
+def load_config(fn, base=DEFAULT_REGISTRY):
+    """Load modes from a turnt config's `envs` tables or a brench config's
+    `runs` tables, and get a registry with them added to the `base` one.
+    Each table with a `mode` key defines a mode with the table's name,
+    where the key's value is the regex for its commands, and a `gate` key
+    says whether the mode's slowdowns are regressions.
+    """
+    try:
+        from tomllib import loads
+    except ImportError:  # Before Python 3.11.
+        from tomlkit import loads
+    with open(fn) as f:
+        config = loads(f.read())
+
+    modes = dict(base.modes)
+    gated = list(base.gated)
+    for section in ('envs', 'runs'):
+        for name, table in config.get(section, {}).items():
+            if 'mode' in table:
+                modes[name] = str(table['mode'])
+            if 'gate' in table:
+                if table['gate'] and name not in gated:
+                    gated.append(name)
+                elif not table['gate'] and name in gated:
+                    gated.remove(name)
+    return Registry(modes, gated)
+
+
+def get_mode(command, modes=MODES):
+    for mode, pat in modes.items():
+        if re.search(pat, command):
+            return mode
+    sys.exit('unknown benchmark command: {}'.format(command))
+
+
+def hyperfine_metrics(res):
+    """Get the metrics for one of the commands in hyperfine's JSON.
+    """
+    memory = res.get('memory_usage_byte')
+    return {
+        'mean': res['mean'],
+        'stddev': res['stddev'] or 0.0,
+        'user': res.get('user'),
+        'system': res.get('system'),
+        'memory': statistics.mean(memory) if memory else None,
+        'times': res.get('times') or [res['mean']],
+    }
+
+
+def get_brench_results(fn):
+    """Read the records that `brench --json` exports, one per line, where
+    each run is a mode and the first run is the baseline. The times for
+    each benchmark under each run are pooled across all the sweeps.
+    """
+    times = defaultdict(list)
+    usages = defaultdict(list)
+    baselines = {}
+    with open(fn) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            if rec['status'] or not rec['usage']:
+                continue
+            key = rec['benchmark'], rec['run']
+            times[key] += rec['trials'] or [rec['usage']['wall']]
+            usages[key].append(rec['usage'])
+            baselines[rec['benchmark']] = rec['baseline']
 
-def get_results(bench_files):
+    for (bench, mode), ts in times.items():
+        usage = usages[bench, mode]
+        yield bench, mode, {
+            'mean': statistics.mean(ts),
+            'stddev': statistics.stdev(ts) if len(ts) > 1 else 0.0,
+            'user': statistics.mean(u['user'] for u in usage),
+            'system': statistics.mean(u['sys'] for u in usage),
+            'memory': max(u['maxrss'] for u in usage) * 1024,
+            'times': ts,
+        }, baselines[bench]
+
+
+def get_results(bench_files, modes=MODES):
     for fn in bench_files:
+        if fn.endswith('.jsonl'):
+            yield from get_brench_results(fn)
+            continue
+
         with open(fn) as f:
             bench_data = json.load(f)
 
         bench, _ = os.path.basename(fn).split('.', 1)
         for res in bench_data["results"]:
-            for mode, pat in MODES.items():
-                if re.search(pat, res['command']):
-                    break
-            else:
-                assert False, "unknown benchmark command"
+            yield (bench, get_mode(res['command'], modes),
+                   hyperfine_metrics(res),
+                   BASELINE)
 
-            yield bench, mode, res
 
+def speedup_matrix(means, modes=MODES):
+    """Get the harmonic mean speedup of each mode over each other mode,
+    across the benchmarks that ran under both, as a dict mapping pairs of
+    modes to speedups. `means` maps benchmarks to dicts mapping modes to
+    mean times. Modes are ordered as in `modes`, then as they appear.
+    """
+    seen = dict.fromkeys(m for ms in means.values() for m in ms)
+    order = [m for m in modes if m in seen] + \
+        [m for m in seen if m not in modes]
+    matrix = {}
+    for mode in order:
+        for other in order:
+            speedups = [ms[other] / ms[mode] for ms in means.values()
+                        if mode in ms and other in ms]
+            if speedups:
+                matrix[mode, other] = statistics.harmonic_mean(speedups)
+    return order, matrix
 
-def summarize(bench_files):
+
+def summarize(bench_files, baseline=None, matrix_fn=None,
+              registry=DEFAULT_REGISTRY):
     means = defaultdict(dict)
-    results = list(get_results(bench_files))
-    for bench, mode, res in results:
+    results = list(get_results(bench_files, registry.modes))
+    for bench, mode, res, _ in results:
         means[bench][mode] = res['mean']
 
     writer = csv.DictWriter(
         sys.stdout,
-        ['bench', 'mode', 'mean', 'stddev', 'speedup'],
+        ['bench', 'mode'] + METRICS + ['speedup'],
+        extrasaction='ignore',
     )
     writer.writeheader()
-    speedups = {k: [] for k in MODES}
-    for bench, mode, res in results:
-        speedup = means[bench][BASELINE] / res['mean']
-        print('{} {} {:.2f}x'.format(bench, mode, speedup), file=sys.stderr)
-        speedups[mode].append(speedup)
+    speedups = defaultdict(list, {k: [] for k in registry.modes})
+    for bench, mode, res, bench_baseline in results:
+        base = means[bench].get(baseline or bench_baseline)
+        speedup = base / res['mean'] if base else None
+        if speedup:
+            print('{} {} {:.2f}x'.format(bench, mode, speedup),
+                  file=sys.stderr)
+            speedups[mode].append(speedup)
 
-        writer.writerow({
-            'bench': bench,
-            'mode': mode,
-            'mean': res['mean'],
-            'stddev': res['stddev'],
-            'speedup': speedup,
-        })
+        writer.writerow(dict(res, bench=bench, mode=mode, speedup=speedup))
 
     # Filter out modes which don't have data, and thus no speedups.
     speedups = {k: v for k, v in speedups.items() if v}
@@ -66,6 +198,280 @@ def summarize(bench_files):
             statistics.harmonic_mean(speedup_list)
         ), file=sys.stderr)
 
+    # Show each mode's speedup over every other mode.
+    modes, matrix = speedup_matrix(means, registry.modes)
+    if len(modes) > 1:
+        width = max(len(m) for m in modes)
+        print('speedups (row over column):', file=sys.stderr)
+        print(' ' * width, *(m.rjust(width) for m in modes), file=sys.stderr)
+        for mode in modes:
+            print(mode.ljust(width), *(
+                '{:.2f}x'.format(matrix[mode, other]).rjust(width)
+                if (mode, other) in matrix else '-'.rjust(width)
+                for other in modes
+            ), file=sys.stderr)
+    if matrix_fn:
+        with open(matrix_fn, 'w') as f:
+            matrix_writer = csv.writer(f)
+            matrix_writer.writerow(['mode'] + modes)
+            for mode in modes:
+                matrix_writer.writerow([mode] + [
+                    matrix.get((mode, other), '') for other in modes
+                ])
+
+
+def current_commit(dirty_ok=False):
+    """Get the short hash of HEAD. Timings from a tree with uncommitted
+    changes aren't really for HEAD, so in that case, add a `-dirty` suffix
+    if `dirty_ok`, or else exit with an error.
+    """
+    def git(*args):
+        proc = subprocess.run(['git'] + list(args),
+                              capture_output=True, text=True)
+        if proc.returncode:
+            sys.exit('could not find the current commit; use --commit')
+        return proc.stdout.strip()
+
+    commit = git('rev-parse', '--short', 'HEAD')
+    if git('status', '--porcelain', '--untracked-files=no'):
+        if not dirty_ok:
+            sys.exit('the working tree has uncommitted changes; commit '
+                     'them first, or use --commit')
+        commit += '-dirty'
+    return commit
+
+
+def record(history_fn, commit, bench_files, modes=MODES):
+    """Add the timings for each benchmark and mode to a history file, as
+    JSON records (one per line) tagged with the commit. Any records
+    already there for the same commit are replaced, so that re-recording
+    a commit doesn't mix the new timings with the old ones.
+    """
+    kept = []
+    dropped = 0
+    if os.path.exists(history_fn):
+        with open(history_fn) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                if json.loads(line)['commit'] == commit:
+                    dropped += 1
+                else:
+                    kept.append(line if line.endswith('\n') else line + '\n')
+    if dropped:
+        print('replacing {} records for commit {}'.format(dropped, commit),
+              file=sys.stderr)
+
+    date = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    tmp_fn = history_fn + '.tmp'
+    with open(tmp_fn, 'w') as f:
+        f.writelines(kept)
+        for bench, mode, res, _ in get_results(bench_files, modes):
+            json.dump({
+                'commit': commit,
+                'date': date,
+                'bench': bench,
+                'mode': mode,
+                'times': res['times'],
+            }, f)
+            f.write('\n')
+    os.replace(tmp_fn, history_fn)
+
+
+def load_history(history_fn):
+    """Read a history file into a dict mapping each commit, in the order
+    they were first recorded, to a dict mapping (bench, mode) pairs to all
+    the times recorded for that commit.
+    """
+    history = {}
+    with open(history_fn) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            times = history.setdefault(rec['commit'], defaultdict(list))
+            times[rec['bench'], rec['mode']] += rec['times']
+    return history
+
+
+def mann_whitney(xs, ys):
+    """Get the one-sided p-value, from the Mann-Whitney U test, for the
+    hypothesis that values in `ys` tend to be larger than those in `xs`.
+
+    This uses the normal approximation (with corrections for ties and
+    continuity), which is reasonable for hyperfine's usual 10+ runs.
+    """
+    n1, n2 = len(xs), len(ys)
+    n = n1 + n2
+    values = sorted([(x, 0) for x in xs] + [(y, 1) for y in ys])
+
+    # Assign average ranks to runs of tied values.
+    rank_sum = 0.0
+    ties = 0
+    i = 0
+    while i < n:
+        j = i
+        while j < n and values[j][0] == values[i][0]:
+            j += 1
+        rank = (i + j + 1) / 2
+        rank_sum += rank * sum(group for _, group in values[i:j])
+        ties += (j - i) ** 3 - (j - i)
+        i = j
+
+    u = rank_sum - n2 * (n2 + 1) / 2
+    var = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1))) if n > 1 else 0
+    if var <= 0:
+        return 1.0
+    z = (u - n1 * n2 / 2 - 0.5) / var ** 0.5
+    return 1 - statistics.NormalDist().cdf(z)
+
+
+def compare(before, after, alpha, threshold, gated=GATED):
+    """Compare two sets of timings, each a dict mapping (bench, mode) pairs
+    to lists of times, and generate a report entry for each pair in both.
+
+    A change is significant when the test's p-value is below `alpha` and
+    the medians differ by more than the `threshold` fraction. Significant
+    slowdowns in gated modes are regressions.
+    """
+    for key in sorted(after.keys() & before.keys()):
+        bench, mode = key
+        old, new = before[key], after[key]
+        ratio = statistics.median(new) / statistics.median(old)
+        slower = mann_whitney(old, new)
+        faster = mann_whitney(new, old)
+        if slower < alpha and ratio > 1 + threshold:
+            change = 'slower'
+        elif faster < alpha and ratio < 1 - threshold:
+            change = 'faster'
+        else:
+            change = None
+        yield {
+            'bench': bench,
+            'mode': mode,
+            'before': statistics.median(old),
+            'after': statistics.median(new),
+            'ratio': ratio,
+            'p': min(slower, faster),
+            'change': change,
+            'regression': change == 'slower' and mode in gated,
+        }
+
+
+def check(history_fn, commit, against, bench_files, alpha, threshold,
+          registry=DEFAULT_REGISTRY):
+    """Compare the current timings against an earlier commit's and print
+    the report. Return whether there were any regressions.
+    """
+    history = load_history(history_fn)
+    if against is None:
+        earlier = [c for c in history if c != commit]
+        if not earlier:
+            sys.exit('no earlier commit in {}'.format(history_fn))
+        against = earlier[-1]
+    elif against not in history:
+        sys.exit('commit {} not in {}'.format(against, history_fn))
+
+    current = defaultdict(list)
+    for bench, mode, res, _ in get_results(bench_files, registry.modes):
+        current[bench, mode] += res['times']
+
+    results = list(compare(history[against], current, alpha, threshold,
+                           registry.gated))
+    regressions = [r for r in results if r['regression']]
+    json.dump({
+        'commit': commit,
+        'against': against,
+        'alpha': alpha,
+        'threshold': threshold,
+        'gated': list(registry.gated),
+        'results': results,
+        'regressions': len(regressions),
+    }, sys.stdout, indent=2)
+    print()
+    for r in regressions:
+        print('regression: {} {} {:.2f}x slower (p = {:.3g})'.format(
+            r['bench'], r['mode'], r['ratio'], r['p'],
+        ), file=sys.stderr)
+    return bool(regressions)
+
+
+def changes(history_fn, alpha, threshold, gated=GATED):
+    """Report each commit in the history where some benchmark's timings
+    changed significantly from the previous commit that measured it.
+    """
+    history = load_history(history_fn)
+    latest = {}
+    alerts = []
+    for commit, times in history.items():
+        before = {k: latest[k][1] for k in times if k in latest}
+        for res in compare(before, times, alpha, threshold, gated):
+            if res['change']:
+                res['before_commit'] = latest[res['bench'], res['mode']][0]
+                res['commit'] = commit
+                alerts.append(res)
+        latest.update((k, (commit, ts)) for k, ts in times.items())
+
+    json.dump({
+        'alpha': alpha,
+        'threshold': threshold,
+        'gated': list(gated),
+        'changes': alerts,
+    }, sys.stdout, indent=2)
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('files', nargs='*', metavar='FILE',
+                        help='hyperfine JSON or brench JSON records')
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument('--record', action='store_true',
+                        help='add the timings to the history')
+    action.add_argument('--check', action='store_true',
+                        help='check the timings for regressions')
+    action.add_argument('--changes', action='store_true',
+                        help='report significant changes in the history')
+    parser.add_argument('--history', default='history.jsonl',
+                        help='history file (default: %(default)s)')
+    parser.add_argument('--commit',
+                        help='commit the timings are for (default: HEAD, '
+                        'which must be clean to record)')
+    parser.add_argument('--against', metavar='COMMIT',
+                        help='commit to check against (default: the '
+                        'latest other commit in the history)')
+    parser.add_argument('--alpha', type=float, default=0.01,
+                        help='significance level (default: %(default)s)')
+    parser.add_argument('--threshold', type=float, default=0.05,
+                        help='smallest relative change to report '
+                        '(default: %(default)s)')
+    parser.add_argument('--config', default=DEFAULT_CONFIG,
+                        help='turnt or brench config with more modes '
+                        '(default: turnt.toml here, if it exists)')
+    parser.add_argument('-b', '--baseline',
+                        help='mode to compute speedups over (default: '
+                        'brili, or the first run for brench records)')
+    parser.add_argument('--matrix', metavar='FILE',
+                        help='write the speedup matrix to a CSV file')
+    args = parser.parse_args()
+
+    registry = DEFAULT_REGISTRY
+    if args.config != DEFAULT_CONFIG or os.path.exists(args.config):
+        registry = load_config(args.config)
+
+    if args.changes:
+        changes(args.history, args.alpha, args.threshold, registry.gated)
+        return
+    if args.record or args.check:
+        commit = args.commit or current_commit(dirty_ok=args.check)
+        if args.record:
+            record(args.history, commit, args.files, registry.modes)
+        elif check(args.history, commit, args.against, args.files,
+                   args.alpha, args.threshold, registry):
+            sys.exit(1)
+        return
+    summarize(args.files, args.baseline, args.matrix, registry)
+
 
 if __name__ == '__main__':
-    summarize(sys.argv[1:])
+    main()
@@ -10,19 +10,352 @@ import sys
 import os
 from concurrent import futures
 import glob
+import collections
+import threading
+import time
+import contextlib
+import statistics
+import math
+import hashlib
+import json
+import shlex
+import functools
+import importlib
+import itertools
+import multiprocessing
+import resource
+import traceback
+import signal
+import queue
+import tempfile
+import shutil
+import platform
+import datetime
+import uuid
 
 __version__ = '1.0.0'
 
 ARGS_RE = r'ARGS: (.*)'
 
+# Pipeline steps with this prefix are Python functions to call in a
+# worker process instead of shell commands (see `run_py`).
+PY_PREFIX = 'py:'
 
-def run_pipe(cmds, input, timeout):
+# The resources used by a pipeline: wall-clock time, user and system CPU
+# time (all in seconds), and peak resident set size (in KiB), as totals
+# for the whole pipeline. `stages` has a `StageUsage` for each command,
+# `cpus` lists the CPUs the pipeline was pinned to, if any, and `cached`
+# says whether any of it came from the result cache instead of running.
+Usage = collections.namedtuple('Usage', ['wall', 'user', 'sys', 'maxrss',
+                                         'stages', 'cpus', 'cached'],
+                               defaults=[None, False])
+StageUsage = collections.namedtuple('StageUsage', ['user', 'sys', 'maxrss'])
+USAGE_COLUMNS = ['wall', 'user', 'sys', 'maxrss', 'stages']
+
+# A first run with one of these results means the other runs of the same
+# benchmark can't be checked, so they are cancelled. (A first run can only
+# be `incorrect` if its Python steps fail the `--check-py` check.)
+FAILED = ('timeout', 'missing', 'incorrect')
+
+# The values of the `result` column that are not extracted results.
+STATUSES = ('incorrect', 'timeout', 'missing', 'cancelled')
+
+# Statistics over the wall-clock times of repeated trials.
+TRIAL_COLUMNS = ['mean', 'median', 'stddev', 'min', 'ci_low', 'ci_high']
+
+# Two-sided 95% critical values of Student's t distribution, indexed by
+# degrees of freedom minus one. Larger samples use the normal value.
+T_95 = [
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+]
+
+
+def read_output(proc, sink=None):
+    """Start collecting the stdout and stderr of a process.
+
+    This is like `Popen.communicate`, but it does not wait for the
+    process to exit: the caller must reap it (see `wait_usage`). Returns
+    a function that waits for the output until a `time.monotonic`
+    deadline, if any, and then returns it or raises
+    `subprocess.TimeoutExpired`.
+
+    With a `sink` (a `HashedOutput`), stdout is streamed into it instead
+    of being kept, and the sink is returned in its place.
+    """
+    outs = [[], []]
+    threads = [
+        threading.Thread(target=lambda s=stream, o=out: o.append(s.read()),
+                         daemon=True)
+        for stream, out in zip((proc.stdout, proc.stderr), outs)
+    ]
+    if sink is not None:
+        threads[0] = threading.Thread(
+            target=lambda: outs[0].append(sink.consume(proc.stdout)),
+            daemon=True,
+        )
+    for thread in threads:
+        thread.start()
+
+    def finish(deadline=None):
+        for thread in threads:
+            thread.join(None if deadline is None
+                        else max(deadline - time.monotonic(), 0))
+            if thread.is_alive():
+                raise subprocess.TimeoutExpired(proc.args, None)
+        return outs[0][0], outs[1][0]
+
+    return finish
+
+
+def write_input(stream, data):
+    """Write a string to a process's stdin and close it, ignoring a
+    process that exits without reading everything.
+    """
+    try:
+        stream.write(data)
+        stream.close()
+    except (BrokenPipeError, ValueError):
+        pass
+
+
+class HashedOutput:
+    """A run's final output, reduced to what Brench needs from it: a
+    digest for checking correctness, its size in bytes, and the first
+    match of the `extract` pattern on any line.
+
+    Output is written in pieces, so memory use does not depend on its
+    size. With `spool`, the output is also saved to a file in that
+    directory, so that it can be compared line by line with another run's
+    (see `first_difference`).
+    """
+
+    # Longer lines are searched in pieces of this many characters.
+    MAX_LINE = 1 << 20
+
+    def __init__(self, pattern, spool=None):
+        self.pattern = pattern
+        self.hash = hashlib.sha256()
+        self.digest = None
+        self.size = 0
+        self.match = None
+        self.partial = ''
+        self.path = None
+        self.file = None
+        if spool:
+            fd, self.path = tempfile.mkstemp(dir=spool, suffix='.out')
+            self.file = os.fdopen(fd, 'wb')
+
+    def write(self, text):
+        data = text.encode('utf8')
+        self.hash.update(data)
+        self.size += len(data)
+        if self.file:
+            self.file.write(data)
+
+        # Look for the pattern in each complete line.
+        if self.match is None:
+            lines = (self.partial + text).split('\n')
+            self.partial = lines.pop()
+            if len(self.partial) > self.MAX_LINE:
+                lines.append(self.partial)
+                self.partial = ''
+            self._search(lines)
+
+    def _search(self, lines):
+        for line in lines:
+            match = re.search(self.pattern, line)
+            if match:
+                self.match = match.group(1)
+                self.partial = ''
+                return
+
+    def close(self):
+        if self.match is None:
+            self._search([self.partial])
+        self.partial = ''
+        self.digest = self.hash.hexdigest()
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def consume(self, stream):
+        """Write everything from a text stream and close the output.
+        """
+        for text in iter(lambda: stream.read(1 << 16), ''):
+            self.write(text)
+        self.close()
+        return self
+
+    def discard(self):
+        """Delete the spooled copy of the output, if any.
+        """
+        if self.path:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+    def record(self):
+        """Describe the output for the result cache.
+        """
+        return {'digest': self.digest, 'size': self.size,
+                'match': self.match, 'pattern': self.pattern}
+
+    def restore(self, record):
+        """Fill in the output from a cached `record` (without a spooled
+        copy) and return it.
+        """
+        self.close()
+        self.discard()
+        self.digest = record['digest']
+        self.size = record['size']
+        self.match = record['match']
+        return self
+
+
+def wait_usage(proc, deadline=None):
+    """Wait for a process to exit and get its resource usage as a
+    `StageUsage`.
+
+    The wait happens in a helper thread, so it returns as soon as the
+    process exits instead of at the next poll, which would add the poll
+    interval to the measured time. Once the `time.monotonic` deadline (if
+    any) passes, raise `subprocess.TimeoutExpired`; the thread then goes
+    on waiting and reaps the process after it is killed.
+    """
+    done = []
+
+    def wait():
+        try:
+            pid, status, ru = os.wait4(proc.pid, 0)
+        except ChildProcessError:
+            return  # `Popen.wait` got to it first, after a timeout.
+        # Record the exit status so `Popen` doesn't try to reap it again.
+        if os.WIFSIGNALED(status):
+            proc.returncode = -os.WTERMSIG(status)
+        else:
+            proc.returncode = os.WEXITSTATUS(status)
+        done.append(ru)
+
+    waiter = threading.Thread(target=wait, daemon=True)
+    waiter.start()
+    waiter.join(None if deadline is None
+                else max(deadline - time.monotonic(), 0))
+    if not done:
+        raise subprocess.TimeoutExpired(proc.args, None)
+    ru, = done
+
+    # `ru_maxrss` is in bytes on macOS and KiB elsewhere.
+    maxrss = ru.ru_maxrss // 1024 if sys.platform == 'darwin' \
+        else ru.ru_maxrss
+    return StageUsage(ru.ru_utime, ru.ru_stime, maxrss)
+
+
+class Cancelled(Exception):
+    """A run was cancelled before it could finish.
+    """
+
+
+class StepMismatch(Exception):
+    """Some Python steps produced a different program in the worker than
+    when run as separate processes (see `check_py_steps`).
+    """
+
+
+class Running:
+    """Keep track of how to stop the jobs running for each benchmark, so
+    that a benchmark's remaining runs (or the whole sweep) can be
+    cancelled.
+
+    Jobs belong to the benchmark that their thread is working on, which
+    is set in `local.fn`.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.kills = collections.defaultdict(set)
+        self.cancelled = set()
+        self.everything = False
+
+    def is_cancelled(self, fn):
+        return self.everything or fn in self.cancelled
+
+    @contextlib.contextmanager
+    def job(self, kill):
+        """Run a job that can be stopped by calling `kill`, and raise
+        `Cancelled` if its benchmark is cancelled (before or while it
+        runs).
+        """
+        fn = getattr(self.local, 'fn', None)
+        with self.lock:
+            cancelled = self.is_cancelled(fn)
+            if not cancelled:
+                self.kills[fn].add(kill)
+        if cancelled:
+            kill()
+            raise Cancelled()
+
+        try:
+            yield
+        except Exception:
+            if self.is_cancelled(fn):
+                raise Cancelled()
+            raise
+        finally:
+            with self.lock:
+                self.kills[fn].discard(kill)
+        if self.is_cancelled(fn):
+            raise Cancelled()
+
+    def cancel(self, fn=None):
+        """Stop the jobs for a benchmark, or for every benchmark, and
+        prevent any more from starting.
+        """
+        with self.lock:
+            if fn is None:
+                self.everything = True
+                kills = set().union(*self.kills.values())
+            else:
+                self.cancelled.add(fn)
+                kills = set(self.kills[fn])
+        for kill in kills:
+            kill()
+
+
+# The jobs that are running in this process.
+RUNNING = Running()
+
+
+def kill_groups(procs):
+    """Kill the process groups of some pipeline stages, including any
+    processes they started.
+    """
+    for proc in procs:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+def run_pipe(cmds, input, timeout, stage_timeout=None, sink=None):
     """Execute a pipeline of shell commands.
 
     Send the given input (text) string into the first command, then pipe
     the output of each command into the next command in the sequence.
-    Collect and return the stdout and stderr from the final command.
+    Collect and return the stdout and stderr from the final command and
+    the resources used by the pipeline (a `Usage`).
+
+    Each command runs in a new process group, so that everything it
+    starts gets killed if the pipeline times out or is cancelled. With a
+    `stage_timeout`, each command must also exit within that many seconds
+    after the command before it. With a `sink`, the final stdout goes
+    there (see `read_output`).
     """
+    start = time.monotonic()
     procs = []
     for cmd in cmds:
         last = len(procs) == len(cmds) - 1
@@ -33,21 +366,569 @@ def run_pipe(cmds, input, timeout):
             stdin=procs[-1].stdout if procs else subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE if last else subprocess.DEVNULL,
+            start_new_session=True,
         )
         procs.append(proc)
 
+    finished = False
     try:
-        # Send stdin and collect stdout.
-        procs[0].stdin.write(input)
-        procs[0].stdin.close()
-        return procs[-1].communicate(timeout=timeout)
+        with RUNNING.job(lambda: kill_groups(procs)):
+            # Send stdin from a separate thread, so a large input (such as
+            # the output of a shared prefix) cannot fill the pipes and
+            # deadlock.
+            threading.Thread(target=write_input,
+                             args=(procs[0].stdin, input),
+                             daemon=True).start()
+            finish = read_output(procs[-1], sink)
+            deadline = None if timeout is None else start + timeout
+
+            # With a per-stage timeout, reap each process in order as it
+            # exits. Otherwise, wait for the output and then reap them.
+            stages = []
+            if stage_timeout is not None:
+                stage_start = start
+                for proc in procs:
+                    stage_deadline = stage_start + stage_timeout
+                    if deadline is not None:
+                        stage_deadline = min(stage_deadline, deadline)
+                    stages.append(wait_usage(proc, stage_deadline))
+                    stage_start = time.monotonic()
+            stdout, stderr = finish(deadline)
+            if not stages:
+                stages = [wait_usage(proc, deadline) for proc in procs]
+
+        usage = Usage(
+            wall=time.monotonic() - start,
+            user=sum(s.user for s in stages),
+            sys=sum(s.sys for s in stages),
+            maxrss=max(s.maxrss for s in stages),
+            stages=stages,
+            cpus=getattr(RUNNING.local, 'cpus', None),
+        )
+        finished = True
+        return stdout, stderr, usage
     finally:
+        if not finished:
+            kill_groups(procs)
         for proc in procs:
-            proc.kill()
+            if proc.returncode is None:
+                proc.kill()
+                proc.wait()
+
+
+def is_py_step(cmd):
+    """Check whether a pipeline step is an in-process Python step.
+    """
+    return cmd.startswith(PY_PREFIX)
+
+
+def step_path(spec):
+    """Get the local source file for a Python step's `MODULE:FUNCTION`
+    spec, or None if the module is not a local file.
+
+    `MODULE` is either a path to a `.py` file or a dotted name, which is
+    looked up relative to the working directory.
+    """
+    module_name, _, _ = spec.rpartition(':')
+    if module_name.endswith('.py'):
+        path = module_name
+    else:
+        path = module_name.replace('.', os.sep) + '.py'
+    return path if os.path.isfile(path) else None
+
+
+@functools.lru_cache(maxsize=None)
+def load_step(spec):
+    """Import the function for a Python step (once per process).
+
+    A local module's directory goes on `sys.path` first, so that it can
+    import its neighbors just like when it runs as a script.
+    """
+    module_name, _, func_name = spec.rpartition(':')
+    path = step_path(spec)
+    if path:
+        directory = os.path.dirname(os.path.abspath(path))
+        if directory not in sys.path:
+            sys.path.insert(0, directory)
+        module_name, _ = os.path.splitext(os.path.basename(path))
+    module = importlib.import_module(module_name)
+    return getattr(module, func_name)
+
+
+# A script for running one Python step in a process of its own, the way a
+# `python3 pass.py` command would: `python3 -c SCRIPT MODULE:FUNCTION
+# ARGS...`. The `{}` is Brench's directory.
+PY_STEP_SCRIPT = """
+import json, sys
+sys.path.insert(0, {!r})
+from brench import load_step
+spec, *args = sys.argv[1:]
+prog = json.load(sys.stdin)
+result = load_step(spec)(prog, *args)
+json.dump(prog if result is None else result, sys.stdout)
+"""
+
+
+def py_step_command(cmd):
+    """Get a shell command that runs a Python step in a new process.
+    """
+    script = PY_STEP_SCRIPT.format(os.path.dirname(os.path.abspath(__file__)))
+    return shlex.join([sys.executable, '-c', script] +
+                      shlex.split(cmd[len(PY_PREFIX):]))
+
+
+def same_program(first, second):
+    """Check whether two JSON texts hold the same program (comparing them
+    as text if either is not JSON, such as the empty output of a step
+    that crashed).
+    """
+    try:
+        return json.loads(first) == json.loads(second)
+    except ValueError:
+        return first == second
+
+
+def run_py_steps(steps, input):
+    """Run Python steps on a JSON program, in a worker process.
+
+    Each step is a list of words: a `MODULE:FUNCTION` spec and any extra
+    (string) arguments for the function, which gets the program as a
+    dict first. The function returns a new program or None to keep the
+    program it modified in place. Returns the stdout and stderr text and
+    a `StageUsage` for each step. Errors produce empty output and a
+    traceback on stderr, much as a crashing script would.
+    """
+    stages = []
+    try:
+        # `getrusage` has microsecond resolution, unlike `os.times`, which
+        # ticks too coarsely to tell quick steps apart.
+        before = resource.getrusage(resource.RUSAGE_SELF)
+        prog = json.loads(input)
+        for i, (spec, *args) in enumerate(steps):
+            result = load_step(spec)(prog, *args)
+            if result is not None:
+                prog = result
+            if i == len(steps) - 1:
+                output = json.dumps(prog)
+            after = resource.getrusage(resource.RUSAGE_SELF)
+            maxrss = after.ru_maxrss
+            if sys.platform == 'darwin':
+                maxrss //= 1024
+            stages.append(StageUsage(after.ru_utime - before.ru_utime,
+                                     after.ru_stime - before.ru_stime,
+                                     maxrss))
+            before = after
+    except Exception:
+        return '', traceback.format_exc(), stages
+    return output, '', stages
+
+
+def py_worker_loop(conn):
+    """Serve requests to run Python steps from a connection until it is
+    closed.
+    """
+    while True:
+        try:
+            steps, input = conn.recv()
+        except EOFError:
+            return
+        conn.send(run_py_steps(steps, input))
+
+
+class PyWorker:
+    """A long-lived process for running Python steps, which keeps the
+    modules it imports loaded between jobs.
+    """
+
+    def __init__(self):
+        context = multiprocessing.get_context('spawn')
+        self.conn, child_conn = context.Pipe()
+        self.proc = context.Process(target=py_worker_loop,
+                                    args=(child_conn,), daemon=True)
+        self.proc.start()
+        child_conn.close()
+
+    def run(self, steps, input, timeout):
+        """Run the steps and return the result of `run_py_steps`.
+        """
+        self.conn.send((steps, input))
+        if not self.conn.poll(timeout):
+            raise subprocess.TimeoutExpired(steps, timeout)
+        return self.conn.recv()
+
+    def kill(self):
+        if self.proc.is_alive():
+            self.proc.kill()
+        self.proc.join()
+        self.conn.close()
+
+
+# Each thread gets its own worker, so a job never waits behind another.
+_py_workers = threading.local()
+
+
+def run_py(cmds, input, timeout, stage_timeout=None):
+    """Run a sequence of Python steps (`py:MODULE:FUNCTION ARGS...`) as a
+    single job in this thread's worker process, so the program is decoded
+    and encoded only once for all of them. Returns `(stdout, stderr,
+    usage)` like `run_pipe`.
+
+    The user and system times for each step are measured in the worker,
+    and `maxrss` is the worker process's peak so far. A worker that times
+    out is killed and replaced by a fresh one for the next job. The steps
+    are timed as a group, so a `stage_timeout` applies to their total.
+    """
+    steps = [shlex.split(cmd[len(PY_PREFIX):]) for cmd in cmds]
+    if stage_timeout is not None:
+        limit = stage_timeout * len(steps)
+        timeout = limit if timeout is None else min(timeout, limit)
+    start = time.monotonic()
+    worker = getattr(_py_workers, 'worker', None)
+    if worker is None:
+        worker = _py_workers.worker = PyWorker()
+    cpus = getattr(RUNNING.local, 'cpus', None)
+    if cpus:
+        os.sched_setaffinity(worker.proc.pid, cpus)
+    try:
+        with RUNNING.job(worker.kill):
+            stdout, stderr, stages = worker.run(steps, input, timeout)
+    except BaseException:
+        worker.kill()
+        _py_workers.worker = None
+        raise
+    usage = Usage(
+        wall=time.monotonic() - start,
+        user=sum(s.user for s in stages),
+        sys=sum(s.sys for s in stages),
+        maxrss=max((s.maxrss for s in stages), default=0),
+        stages=stages,
+        cpus=cpus,
+    )
+    return stdout, stderr, usage
+
+
+def add_usage(first, second):
+    """Combine the `Usage` of two pipelines that ran one after the other.
+    """
+    return Usage(
+        wall=first.wall + second.wall,
+        user=first.user + second.user,
+        sys=first.sys + second.sys,
+        maxrss=max(first.maxrss, second.maxrss),
+        stages=first.stages + second.stages,
+        cpus=sorted(set(first.cpus or []) | set(second.cpus or [])) or None,
+        cached=first.cached or second.cached,
+    )
+
+
+def sink_result(result, sink):
+    """Send the stdout of a `(stdout, stderr, usage)` result to a sink (a
+    `HashedOutput`), if there is one, and put the sink in its place.
+    """
+    stdout, stderr, usage = result
+    if sink is None or not isinstance(stdout, str):
+        return result
+    sink.write(stdout)
+    sink.close()
+    return sink, stderr, usage
+
+
+def check_py_steps(cmds, input, output, timeout, stage_timeout=None):
+    """Check the `output` of some Python steps from `run_py` by running
+    the same steps on the same `input` again, each in a new process with
+    `py_step_command`, and raise `StepMismatch` if the program differs.
+    """
+    expected, _, _ = run_pipe([py_step_command(cmd) for cmd in cmds], input,
+                              timeout, stage_timeout)
+    if not same_program(output, expected):
+        raise StepMismatch('Python steps differ when run as separate '
+                           'processes: {}'.format(', '.join(cmds)))
+
+
+def run_steps(cmds, input, timeout, stage_timeout=None, sink=None,
+              check_py=False):
+    """Run a pipeline that may mix shell commands and Python steps.
+
+    Consecutive shell commands run together with `run_pipe`, and
+    consecutive Python steps with `run_py`. The output of each group goes
+    to the next, and the stdout and stderr of the last group are
+    returned with the total `Usage`. The final stdout goes to `sink`, if
+    given (see `run_pipe`). With `check_py`, the output of each group of
+    Python steps is checked with `check_py_steps`.
+    """
+    if not any(is_py_step(cmd) for cmd in cmds):
+        return run_pipe(cmds, input, timeout, stage_timeout, sink)
+
+    stdout, stderr, usage = input, '', None
+    groups = [(py, list(group))
+              for py, group in itertools.groupby(cmds, is_py_step)]
+    for i, (py, group) in enumerate(groups):
+        remaining = timeout
+        if timeout is not None and usage:
+            remaining = timeout - usage.wall
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(cmds, timeout)
+        last = i == len(groups) - 1
+        if py:
+            result = run_py(group, stdout, remaining, stage_timeout)
+            if check_py:
+                check_py_steps(group, stdout, result[0], remaining,
+                               stage_timeout)
+            if last:
+                result = sink_result(result, sink)
+        else:
+            result = run_pipe(group, stdout, remaining, stage_timeout,
+                              sink if last else None)
+        stdout, stderr, group_usage = result
+        usage = add_usage(usage, group_usage) if usage else group_usage
+    return stdout, stderr, usage
+
+
+@functools.lru_cache(maxsize=None)
+def file_digest(path):
+    """Hash the contents of a file (once per process)."""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
 
 
-def run_bench(pipeline, fn, timeout):
+def local_files(cmds):
+    """Find the local files that a list of shell commands (or Python
+    steps) refer to.
+
+    For Python scripts, every other `.py` file in the same directory is
+    included too, to account for the modules they import.
+    """
+    paths = set()
+    for cmd in cmds:
+        py = is_py_step(cmd)
+        if py:
+            cmd = cmd[len(PY_PREFIX):]
+        try:
+            words = shlex.split(cmd)
+        except ValueError:
+            words = cmd.split()
+        if py and words:
+            words[0] = step_path(words[0]) or ''
+        for word in words:
+            if os.path.isfile(word):
+                paths.add(os.path.normpath(word))
+                if word.endswith('.py'):
+                    paths.update(glob.glob(os.path.join(
+                        os.path.dirname(word) or '.', '*.py',
+                    )))
+    return sorted(os.path.normpath(p) for p in paths)
+
+
+class ResultCache:
+    """An on-disk cache of pipeline results, addressed by a hash of the
+    pipeline's commands, its input, and the local files it uses.
+
+    A result whose stdout went to a sink holds only the sink's record
+    (see `HashedOutput.record`), so it is stored under a key that also
+    covers the sink's pattern. That way it never replaces the full output
+    for the same pipeline, which can serve runs with or without a sink.
+
+    With `force`, cached results are ignored (but still replaced).
+    """
+    def __init__(self, path, force=False):
+        self.path = path
+        self.force = force
+
+    def key(self, cmds, input):
+        h = hashlib.sha256()
+        h.update(input.encode('utf8'))
+        for cmd in cmds:
+            h.update(b'\0cmd\0' + cmd.encode('utf8'))
+        for path in local_files(cmds):
+            h.update('\0file\0{}\0{}'.format(path, file_digest(path))
+                     .encode('utf8'))
+        return h.hexdigest()
+
+    def _file(self, key, sink=None):
+        if sink is not None:
+            key = hashlib.sha256('{}\0sink\0{}'.format(key, sink.pattern)
+                                 .encode('utf8')).hexdigest()
+        return os.path.join(self.path, key[:2], key + '.json')
+
+    def _load(self, fn):
+        try:
+            with open(fn) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, key, sink=None):
+        """Look up a `run_pipe` result, or return None on a miss.
+
+        With a `sink`, the cached stdout goes there, like in `run_pipe`,
+        and a result stored from a sink with the same pattern is used if
+        there is no full output. The usage is marked as `cached`.
+        """
+        if self.force:
+            return None
+        for fn in [self._file(key)] + \
+                ([self._file(key, sink)] if sink is not None else []):
+            data = self._load(fn)
+            if data is not None:
+                break
+        else:
+            return None
+        stdout = data['stdout']
+        if isinstance(stdout, dict):
+            stdout = sink.restore(stdout)
+        os.utime(fn)  # Mark the entry as recently used.
+        usage = data['usage']
+        usage['stages'] = [StageUsage(*s) for s in usage['stages']]
+        usage['cached'] = True
+        return sink_result((stdout, data['stderr'], Usage(**usage)), sink)
+
+    def put(self, key, result):
+        """Store a `run_pipe` result."""
+        stdout, stderr, usage = result
+        fn = self._file(
+            key, stdout if isinstance(stdout, HashedOutput) else None,
+        )
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(fn, threading.get_ident())
+        with open(tmp, 'w') as f:
+            json.dump({
+                'stdout': stdout.record()
+                if isinstance(stdout, HashedOutput) else stdout,
+                'stderr': stderr,
+                'usage': usage._asdict(),
+            }, f)
+        os.replace(tmp, fn)
+
+    def evict(self, max_age):
+        """Remove entries that have not been used for `max_age` seconds.
+        Return the number of entries removed.
+        """
+        cutoff = time.time() - max_age
+        count = 0
+        for fn in glob.glob(os.path.join(self.path, '*', '*.json')):
+            if os.path.getmtime(fn) < cutoff:
+                os.remove(fn)
+                count += 1
+        return count
+
+
+def run_cached(cmds, input, timeout, cache=None, stage_timeout=None,
+               sink=None, check_py=False):
+    """Run a pipeline with `run_steps`.
+
+    If a `ResultCache` is given, reuse a previous result for the same
+    inputs if there is one, and otherwise save the result (unless the
+    pipeline times out).
+    """
+    if cache:
+        key = cache.key(cmds, input)
+        result = cache.get(key, sink)
+        if result:
+            return result
+    result = run_steps(cmds, input, timeout, stage_timeout, sink, check_py)
+    if cache:
+        cache.put(key, result)
+    return result
+
+
+class SharedPrefixes:
+    """Run the pipelines for one benchmark, running each prefix that
+    several pipelines have in common only once.
+
+    The pipelines are split where they diverge from one another. Each
+    shared piece runs in whichever job needs it first, and the other jobs
+    wait for its output and feed it into the rest of their own pipelines.
+    """
+
+    def __init__(self, pipelines):
+        # How many of the pipelines start with each prefix.
+        self.counts = collections.Counter(
+            tuple(pipeline[:k])
+            for pipeline in pipelines
+            for k in range(1, len(pipeline) + 1)
+        )
+        self.lock = threading.Lock()
+        self.results = {}
+
+    def splits(self, pipeline):
+        """Get the lengths of the prefixes of `pipeline` that end a piece:
+        the points where fewer pipelines share the next command, and the
+        end of the whole pipeline.
+        """
+        counts = [self.counts[tuple(pipeline[:k])]
+                  for k in range(1, len(pipeline) + 1)]
+        return [
+            k for k in range(1, len(pipeline))
+            if counts[k - 1] > 1 and counts[k] < counts[k - 1]
+        ] + [len(pipeline)]
+
+    def run(self, pipeline, cmds, input, timeout, cache=None,
+            stage_timeout=None, sink=None, check_py=False):
+        """Run the commands `cmds` (the expanded form of `pipeline`) on the
+        benchmark input and return `(stdout, stderr, usage)`, where the
+        usage includes any shared pieces. The final stdout goes to `sink`,
+        if given (see `run_pipe`).
+        """
+        result = self._run(pipeline, cmds, self.splits(pipeline), input,
+                           timeout, cache, stage_timeout, sink, check_py)
+        return sink_result(result, sink)
+
+    def _run(self, pipeline, cmds, splits, input, timeout, cache,
+             stage_timeout, sink=None, check_py=False):
+        """Run the prefix of `cmds` ending at the last of `splits`. Shared
+        pieces keep their output, since other pipelines may need it, so
+        only a piece that is not shared uses the `sink`.
+        """
+        *rest, end = splits
+        start = rest[-1] if rest else 0
+
+        def run_piece():
+            if start:
+                prev = self._run(pipeline, cmds, rest, input, timeout,
+                                 cache, stage_timeout, check_py=check_py)
+                stdout, _, usage = prev
+                remaining = None if timeout is None else \
+                    timeout - usage.wall
+                if remaining is not None and remaining <= 0:
+                    raise subprocess.TimeoutExpired(cmds[:start], timeout)
+            else:
+                stdout, usage, remaining = input, None, timeout
+            result = run_cached(cmds[start:end], stdout, remaining, cache,
+                                stage_timeout, sink if not shared else None,
+                                check_py)
+            if usage:
+                result = result[:2] + (add_usage(usage, result[2]),)
+            return result
+
+        # Pieces used by only one pipeline are not worth remembering.
+        key = tuple(pipeline[:end])
+        shared = self.counts[key] > 1
+        if not shared:
+            return run_piece()
+
+        with self.lock:
+            fut = self.results.get(key)
+            owner = fut is None
+            if owner:
+                fut = self.results[key] = futures.Future()
+        if owner:
+            try:
+                fut.set_result(run_piece())
+            except BaseException as exc:
+                fut.set_exception(exc)
+        return fut.result()
+
+
+def run_bench(pipeline, fn, timeout, cache=None, shared=None,
+              stage_timeout=None, sink=None, check_py=False):
     """Run a single benchmark pipeline.
+
+    Results are cached in `cache` (a `ResultCache`), if given. If
+    `shared` is a `SharedPrefixes` for the benchmark, reuse the output of
+    any prefix of the pipeline that another run has in common. The final
+    stdout goes to `sink`, if given (see `run_pipe`). With `check_py`,
+    Python steps are checked against separate processes (see
+    `check_py_steps`).
     """
     # Load the benchmark.
     with open(fn) as f:
@@ -62,7 +943,118 @@ def run_bench(pipeline, fn, timeout):
         c.format(args=args)
         for c in pipeline
     ]
-    return run_pipe(cmds, in_data, timeout)
+    if shared:
+        return shared.run(pipeline, cmds, in_data, timeout, cache,
+                          stage_timeout, sink, check_py)
+    return run_cached(cmds, in_data, timeout, cache, stage_timeout, sink,
+                      check_py)
+
+
+def parse_cpu_list(text):
+    """Parse a Linux CPU list, like `0-3,8`, into a set of CPU numbers.
+    """
+    cpus = set()
+    for part in text.strip().split(','):
+        if part:
+            low, _, high = part.partition('-')
+            cpus.update(range(int(low), int(high or low) + 1))
+    return cpus
+
+
+def pinnable_cpus():
+    """Get the CPUs to pin runs to: the isolated CPUs (see the `isolcpus`
+    kernel parameter) if there are any, or else every CPU that this
+    process may use.
+    """
+    try:
+        with open('/sys/devices/system/cpu/isolated') as f:
+            cpus = parse_cpu_list(f.read())
+    except OSError:
+        cpus = set()
+    return sorted(cpus or os.sched_getaffinity(0))
+
+
+@contextlib.contextmanager
+def pinned(cpu_sets):
+    """Take a set of CPUs from a queue, pin the current thread to them
+    while running a job, and put them back afterward. Processes started
+    by the thread inherit its CPUs. With no queue, do nothing.
+    """
+    if cpu_sets is None:
+        yield
+        return
+    cpus = cpu_sets.get()
+    try:
+        os.sched_setaffinity(0, cpus)
+        RUNNING.local.cpus = cpus
+        yield
+    finally:
+        RUNNING.local.cpus = None
+        cpu_sets.put(cpus)
+
+
+def run_locked(lock, pipeline, fn, timeout, cache=None, shared=None,
+               stage_timeout=None, cpu_sets=None, make_sink=None,
+               check_py=False):
+    """Run a single benchmark pipeline while holding `lock`, pinned to a
+    set of CPUs from the `cpu_sets` queue, if any. The jobs it starts
+    belong to the benchmark `fn` (see `Running`). If given, `make_sink`
+    creates a sink for the final stdout (see `run_pipe`).
+    """
+    RUNNING.local.fn = fn
+    with lock, pinned(cpu_sets):
+        if RUNNING.is_cancelled(fn):
+            raise Cancelled()
+        return run_bench(pipeline, fn, timeout, cache, shared,
+                         stage_timeout, make_sink() if make_sink else None,
+                         check_py)
+
+
+def trial_cells(times):
+    """Summarize the wall-clock times of several trials as CSV cells (see
+    `TRIAL_COLUMNS`), including a 95% confidence interval for the mean.
+    """
+    if not times:
+        return [''] * len(TRIAL_COLUMNS)
+    mean = statistics.mean(times)
+    if len(times) > 1:
+        stddev = statistics.stdev(times)
+        df = len(times) - 1
+        t = T_95[df - 1] if df <= len(T_95) else 1.96
+        half = t * stddev / math.sqrt(len(times))
+    else:
+        stddev = half = 0.0
+    return ['{:.6f}'.format(v) for v in (
+        mean,
+        statistics.median(times),
+        stddev,
+        min(times),
+        mean - half,
+        mean + half,
+    )]
+
+
+def usage_cells(usage):
+    """Format a `Usage` as CSV cells (see `USAGE_COLUMNS`). The `stages`
+    cell lists the CPU time (user plus system) of each pipeline stage.
+    """
+    if usage is None:
+        return [''] * len(USAGE_COLUMNS)
+    return [
+        '{:.4f}'.format(usage.wall),
+        '{:.4f}'.format(usage.user),
+        '{:.4f}'.format(usage.sys),
+        usage.maxrss,
+        ';'.join('{:.4f}'.format(s.user + s.sys) for s in usage.stages),
+    ]
+
+
+def cpu_cell(usage):
+    """Format the CPUs a run was pinned to as a CSV cell.
+    """
+    if usage is None or not usage.cpus:
+        return ''
+    return ';'.join(str(cpu) for cpu in usage.cpus)
 
 
 def get_result(strings, extract_re):
@@ -75,12 +1067,314 @@ def get_result(strings, extract_re):
     return None
 
 
+def sweep_info(config_path):
+    """Describe a sweep for its exported records: an ID for the sweep,
+    when and where it ran, and the git revision (and whether there are
+    uncommitted changes) of the repository holding the configuration.
+    """
+    def git(*args):
+        try:
+            return subprocess.run(
+                ['git'] + list(args),
+                cwd=os.path.dirname(os.path.abspath(config_path)),
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    revision = git('rev-parse', 'HEAD')
+    return {
+        'sweep': uuid.uuid4().hex,
+        'time': datetime.datetime.now(datetime.timezone.utc)
+        .isoformat(timespec='seconds'),
+        'host': {
+            'name': platform.node(),
+            'system': platform.system(),
+            'release': platform.release(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'python': platform.python_version(),
+        },
+        'git': revision and {
+            'revision': revision,
+            'dirty': bool(git('status', '--porcelain',
+                              '--untracked-files=no')),
+        },
+        'config': os.path.abspath(config_path),
+    }
+
+
+def export_record(info, fn, name, pipeline, first, row, digest, results,
+                  timing=False):
+    """Make a record of everything about a benchmark under one run, for
+    exporting as JSON. `info` comes from `sweep_info`; the other
+    arguments are from `collect_row`.
+    """
+    usage = results[0][2] if results else None
+    record = dict(info)
+    record.update({
+        'benchmark': row[0],
+        'file': fn,
+        'run': name,
+        'baseline': first,
+        'pipeline': list(pipeline),
+        'status': row[2] if row[2] in STATUSES else None,
+        'result': row[2] if row[2] not in STATUSES else None,
+        'digest': digest,
+        'usage': usage and dict(
+            usage._asdict(),
+            stages=[s._asdict() for s in usage.stages],
+        ),
+        'trials': [u.wall for _, _, u in results]
+        if timing and results else None,
+    })
+    return record
+
+
+def collect_row(fn, name, futs, first_digest, extract, timing=False,
+                resources=False, pin=False):
+    """Get the results for a benchmark under one run from the futures for
+    its trials, and make its CSV row with `result_row`. Returns the row,
+    the digest of the run's output, and the results of the trials (or
+    None if the run did not finish).
+    """
+    try:
+        results = [f.result() for f in futs]
+    except subprocess.TimeoutExpired:
+        results, status = None, 'timeout'
+    except (Cancelled, futures.CancelledError):
+        results, status = None, 'cancelled'
+    except StepMismatch as exc:
+        print('{}: {}: {}'.format(fn, name, exc), file=sys.stderr)
+        results, status = None, 'incorrect'
+    else:
+        status = None
+    row, digest = result_row(fn, name, results, first_digest, extract,
+                             timing, resources, status, pin)
+    return row, digest, results
+
+
+def discard_outputs(futs):
+    """Delete the spooled outputs from the finished futures.
+    """
+    for fut in futs:
+        if fut.done() and not fut.cancelled() and not fut.exception():
+            stdout = fut.result()[0]
+            if isinstance(stdout, HashedOutput):
+                stdout.discard()
+
+
+def cancel(futs, fn=None):
+    """Cancel the given futures and stop their running jobs, which
+    belong to benchmark `fn` (or to any benchmark if it is None).
+    """
+    for fut in futs:
+        fut.cancel()
+    RUNNING.cancel(fn)
+
+
+def output_digest(stdout):
+    """Hash a run's output, for checking correctness against another run.
+    """
+    return hashlib.sha256(stdout.encode()).hexdigest()
+
+
+def first_difference(expected, actual):
+    """Find where two output files first differ.
+
+    Returns the line number (counting from 1), the byte offset of the
+    first byte that differs, and the two versions of that line (either
+    of which is empty past the end of its file), or None if the files are
+    the same.
+    """
+    offset = 0
+    with open(expected, 'rb') as e, open(actual, 'rb') as a:
+        lines = itertools.zip_longest(e, a, fillvalue=b'')
+        for lineno, (x, y) in enumerate(lines, 1):
+            if x != y:
+                common = os.path.commonprefix([x, y])
+                return lineno, offset + len(common), x, y
+            offset += len(x)
+    return None
+
+
+def record_difference(log, fn, name, first, expected, actual):
+    """Write a JSON line to the file `log` describing where the output of
+    run `name` first differs from the output of run `first`, if both
+    outputs were spooled (see `HashedOutput`).
+    """
+    if not (expected and expected.path and actual and actual.path):
+        return
+    where = first_difference(expected.path, actual.path)
+    if where is None:
+        return
+    lineno, offset, x, y = where
+    log.write(json.dumps({
+        'file': fn,
+        'run': name,
+        'baseline': first,
+        'line': lineno,
+        'offset': offset,
+        'expected': x[:200].decode('utf8', 'replace'),
+        'actual': y[:200].decode('utf8', 'replace'),
+    }) + '\n')
+    log.flush()
+
+
+def result_row(fn, name, results, first_digest, extract, timing=False,
+               resources=False, status=None, pin=False):
+    """Make the CSV row for a benchmark under one run.
+
+    `results` holds the `(stdout, stderr, usage)` for each trial, or is
+    None if the run did not finish, in which case `status` says why.
+    `first_digest` is the output digest of the first run, to check this
+    one against, or None if this is the first run. Returns the row and
+    the digest of this run's output.
+    """
+    if results is None:
+        results = []
+        stdout, stderr, usage = '', '', None
+    else:
+        stdout, stderr, usage = results[0]
+
+    # Check correctness, and extract the figure of merit.
+    if isinstance(stdout, HashedOutput):
+        digest = stdout.digest
+        result = stdout.match or get_result([stderr], extract)
+    else:
+        digest = output_digest(stdout)
+        result = get_result([stdout, stderr], extract)
+    if first_digest is not None and digest != first_digest and not status:
+        status = 'incorrect'
+    if not result and not status:
+        status = 'missing'
+
+    bench, _ = os.path.splitext(os.path.basename(fn))
+    row = [
+        bench,
+        name,
+        status if status else result,
+    ] + (trial_cells([u.wall for _, _, u in results]) if timing else []) + \
+        (usage_cells(usage) if resources else []) + \
+        ([cpu_cell(usage)] if pin else [])
+    return row, digest
+
+
+class Checkpoint:
+    """A file recording each finished row of a sweep, so that an
+    interrupted sweep can pick up where it stopped.
+
+    Each line is a JSON object with the benchmark file, run name, CSV row,
+    and output digest.
+    """
+
+    def __init__(self, path):
+        # Load rows from a previous sweep. The last line may be partial if
+        # that sweep was killed while writing it.
+        self.done = {}
+        line = '\n'
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.done[(record['file'], record['run'])] = record
+
+        self.file = open(path, 'a')
+        if not line.endswith('\n'):
+            self.file.write('\n')
+
+    def record(self, fn, name, row, digest):
+        """Save a finished row.
+        """
+        self.file.write(json.dumps({
+            'file': fn,
+            'run': name,
+            'row': row,
+            'digest': digest,
+        }) + '\n')
+        self.file.flush()
+
+
+class Report:
+    """Write CSV rows to stdout, either as runs finish or (if `sort`) at
+    the end, in the order of the benchmark files and runs.
+    """
+
+    def __init__(self, columns, sort=False, checkpoint=None):
+        self.writer = csv.writer(sys.stdout)
+        self.writer.writerow(columns)
+        sys.stdout.flush()
+        self.columns = columns
+        self.sort = sort
+        self.checkpoint = checkpoint
+        self.rows = {}
+
+    def add(self, fn, name, row, digest, resumed=False):
+        """Report the row for a benchmark under a run, saving it in the
+        checkpoint unless it came from there.
+        """
+        if len(row) != len(self.columns):
+            raise click.ClickException(
+                'checkpoint has different columns; use the same options'
+            )
+        # Cancelled runs are left out of the checkpoint, so that they run
+        # when the sweep resumes.
+        if self.checkpoint and not resumed and row[2] != 'cancelled':
+            self.checkpoint.record(fn, name, row, digest)
+        if self.sort:
+            self.rows[(fn, name)] = row
+        else:
+            self.writer.writerow(row)
+            sys.stdout.flush()
+
+    def finish(self, files, names):
+        """Write the rows that were held back for sorting.
+        """
+        for fn in files:
+            for name in names:
+                if (fn, name) in self.rows:
+                    self.writer.writerow(self.rows[(fn, name)])
+
+
 @click.command()
 @click.option('-j', '--jobs', default=None, type=int,
               help='parallel threads to use (default: suitable for machine)')
+@click.option('-r', '--resources', is_flag=True,
+              help='add columns for time, CPU and memory usage')
+@click.option('--cache', 'cache_dir', type=click.Path(file_okay=False),
+              help='directory for caching results across sweeps')
+@click.option('-f', '--force', is_flag=True,
+              help='rerun everything instead of using cached results')
+@click.option('--evict', type=float, metavar='DAYS',
+              help='first remove cache entries unused for this long')
+@click.option('--no-share', is_flag=True,
+              help='run every pipeline in full, even shared prefixes')
+@click.option('-s', '--sort', is_flag=True,
+              help='write rows in benchmark order at the end')
+@click.option('-c', '--checkpoint', 'checkpoint_path',
+              type=click.Path(dir_okay=False),
+              help='file for recording progress and resuming sweeps')
+@click.option('--deadline', type=float, metavar='SECONDS',
+              help='cancel whatever is left of the sweep after this long')
+@click.option('--pin', type=int, metavar='CPUS',
+              help='pin each run to its own set of this many CPUs')
+@click.option('--hash', 'hash_output', is_flag=True,
+              help='hash outputs instead of keeping them in memory')
+@click.option('--diffs', 'diffs_path', type=click.Path(dir_okay=False),
+              help='file for recording where incorrect outputs differ')
+@click.option('--json', 'json_path', type=click.Path(dir_okay=False),
+              help='file to append a JSON record for each run to')
+@click.option('--check-py', is_flag=True,
+              help='also run Python steps as separate processes and check '
+              'that the results match')
 @click.argument('config_path', metavar='CONFIG', type=click.Path(exists=True))
 @click.argument('files', nargs=-1, type=click.Path(exists=True))
-def brench(config_path, files, jobs):
+def brench(config_path, files, jobs, resources, cache_dir, force, evict,
+           no_share, sort, checkpoint_path, deadline, pin, hash_output,
+           diffs_path, json_path, check_py):
     """Run a batch of benchmarks and emit a CSV of results.
     """
     with open(config_path) as f:
@@ -94,47 +1388,184 @@ def brench(config_path, files, jobs):
         files = sum([glob.glob(f, recursive=True) for f in files], [])
 
     timeout = config.get('timeout', 5)
+    stage_timeout = config.get('stage_timeout')
+    deadline = deadline or config.get('deadline')
 
-    with futures.ThreadPoolExecutor(max_workers=jobs) as pool:
-        # Submit jobs.
-        futs = {}
+    # In timing mode, run every pair several times (after some warmup
+    # runs), and never run two trials of the same benchmark at once.
+    timing = 'trials' in config
+    trials = config.get('trials', 1)
+    warmup = config.get('warmup', 0)
+    locks = {
+        fn: threading.Lock() if timing else contextlib.nullcontext()
+        for fn in files
+    }
+
+    # Set up the result cache. Timing trials are never cached, and neither
+    # are runs whose resource usage is reported, since a cached result's
+    # usage is from whenever it first ran. Checking Python steps means
+    # running them, so it skips the cache too.
+    cache_dir = cache_dir or config.get('cache')
+    cache = ResultCache(cache_dir, force) if cache_dir else None
+    if cache and evict is not None:
+        count = cache.evict(evict * 24 * 60 * 60)
+        print('evicted {} cached results'.format(count), file=sys.stderr)
+    if timing or resources or check_py:
+        cache = None
+
+    # Run prefixes that several pipelines have in common only once for
+    # each benchmark (except when timing, so that each trial runs the
+    # whole pipeline).
+    pipelines = [run['pipeline'] for run in config['runs'].values()]
+    shared = {
+        fn: None if timing or no_share else SharedPrefixes(pipelines)
+        for fn in files
+    }
+
+    # Pin each run to its own set of CPUs, preferably isolated ones, and
+    # run only as many at once as there are sets.
+    pin = pin or config.get('pin')
+    cpu_sets = None
+    if pin:
+        if not hasattr(os, 'sched_setaffinity'):
+            raise click.ClickException('CPU pinning is not supported here')
+        cpus = pinnable_cpus()
+        if len(cpus) < pin:
+            raise click.ClickException(
+                'only {} CPUs available for pinning'.format(len(cpus))
+            )
+        cpu_sets = queue.SimpleQueue()
+        for i in range(len(cpus) // pin):
+            cpu_sets.put(cpus[i * pin:(i + 1) * pin])
+        jobs = min(jobs or len(cpus) // pin, len(cpus) // pin)
+
+    # Stream the final output of each run through a hash instead of
+    # keeping it. To record differences, also spool outputs to disk until
+    # their benchmark is done.
+    hash_output = hash_output or config.get('hash') or diffs_path
+    spool = tempfile.mkdtemp(prefix='brench-') if diffs_path else None
+    diff_log = open(diffs_path, 'a') if diffs_path else None
+    make_sink = functools.partial(HashedOutput, config['extract'], spool) \
+        if hash_output else None
+
+    # Export records with all the details, if requested.
+    export = open(json_path, 'a') if json_path else None
+    info = sweep_info(config_path) if json_path else None
+
+    # Report rows saved by an earlier, interrupted sweep.
+    names = list(config['runs'])
+    report = Report(
+        ['benchmark', 'run', 'result'] +
+        (TRIAL_COLUMNS if timing else []) +
+        (USAGE_COLUMNS if resources else []) +
+        (['cpu'] if pin else []),
+        sort,
+        Checkpoint(checkpoint_path) if checkpoint_path else None,
+    )
+    digests = {}
+    if report.checkpoint:
         for fn in files:
+            for name in names:
+                record = report.checkpoint.done.get((fn, name))
+                if record:
+                    report.add(fn, name, record['row'], record['digest'],
+                               resumed=True)
+                    digests[(fn, name)] = record['digest']
+                    if name == names[0] and record['row'][2] in FAILED:
+                        RUNNING.cancel(fn)
+
+    start = time.monotonic()
+    with futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        # Submit jobs. Trials are interleaved so that the jobs waiting to
+        # run are for different benchmarks.
+        futs = collections.defaultdict(list)
+        owners = {}
+        by_file = collections.defaultdict(list)
+        for i in range(warmup + trials):
             for name, run in config['runs'].items():
-                futs[(fn, name)] = pool.submit(run_bench, run['pipeline'], fn,
-                                               timeout)
+                for fn in files:
+                    if (fn, name) in digests:
+                        continue
+                    fut = pool.submit(run_locked, locks[fn],
+                                      run['pipeline'], fn, timeout, cache,
+                                      shared[fn], stage_timeout, cpu_sets,
+                                      make_sink, check_py)
+                    by_file[fn].append(fut)
+                    if i >= warmup:
+                        futs[(fn, name)].append(fut)
+                        owners[fut] = (fn, name)
 
-        # Collect results and print CSV.
-        writer = csv.writer(sys.stdout)
-        writer.writerow(['benchmark', 'run', 'result'])
-        for fn in files:
-            first_out = None
-            for name in config['runs']:
+        # Report each run as soon as all its trials are done and the first
+        # run of the same benchmark is done too (to check correctness).
+        # When the first run fails, there is nothing to compare the others
+        # to, so they are cancelled. When the deadline passes, everything
+        # left is cancelled.
+        first = names[0]
+        left = {key: len(fs) for key, fs in futs.items()}
+        unreported = collections.Counter(fn for fn, _ in futs)
+        first_outputs = {}
+        waiting = collections.defaultdict(list)
+        pending = set(owners)
+        try:
+            while pending:
                 try:
-                    stdout, stderr = futs[(fn, name)].result()
-                except subprocess.TimeoutExpired:
-                    stdout, stderr = '', ''
-                    status = 'timeout'
-                else:
-                    status = None
-
-                # Check correctness.
-                if first_out is None:
-                    first_out = stdout
-                elif stdout != first_out and not status:
-                    status = 'incorrect'
-
-                # Extract the figure of merit.
-                result = get_result([stdout, stderr], config['extract'])
-                if not result and not status:
-                    status = 'missing'
-
-                # Report the result.
-                bench, _ = os.path.splitext(os.path.basename(fn))
-                writer.writerow([
-                    bench,
-                    name,
-                    status if status else result,
-                ])
+                    for fut in futures.as_completed(
+                        pending,
+                        None if deadline is None
+                        else start + deadline - time.monotonic(),
+                    ):
+                        pending.discard(fut)
+                        fn, name = key = owners[fut]
+                        left[key] -= 1
+                        if left[key]:
+                            continue
+
+                        waiting[fn].append(name)
+                        if (fn, first) not in digests and \
+                                first not in waiting[fn]:
+                            continue
+                        for name in sorted(waiting.pop(fn), key=names.index):
+                            row, digest, results = collect_row(
+                                fn, name, futs[(fn, name)],
+                                digests.get((fn, first))
+                                if name != first else None,
+                                config['extract'], timing, resources, pin,
+                            )
+                            digests[(fn, name)] = digest
+                            report.add(fn, name, row, digest)
+                            output = results[0][0] if results else None
+                            if export:
+                                export.write(json.dumps(export_record(
+                                    info, fn, name,
+                                    config['runs'][name]['pipeline'],
+                                    first, row, digest, results, timing,
+                                )) + '\n')
+                                export.flush()
+                            if name == first:
+                                first_outputs[fn] = output
+                                if row[2] in FAILED:
+                                    cancel(by_file[fn], fn)
+                            elif diff_log and row[2] == 'incorrect':
+                                record_difference(diff_log, fn, name, first,
+                                                  first_outputs.get(fn),
+                                                  output)
+
+                            # Clean up spooled outputs.
+                            unreported[fn] -= 1
+                            if spool and not unreported[fn]:
+                                first_outputs.pop(fn, None)
+                                discard_outputs(by_file[fn])
+                except futures.TimeoutError:
+                    cancel(sum(by_file.values(), []))
+                    deadline = None
+        except KeyboardInterrupt:
+            cancel(sum(by_file.values(), []))
+            raise
+        finally:
+            if spool:
+                shutil.rmtree(spool, ignore_errors=True)
+
+        report.finish(files, names)
 
 
 if __name__ == '__main__':
@@ -7,94 +7,54 @@ import sys
 TERM = 'jmp', 'br', 'ret'
 
 
-# From Lesson 2
-def form_blocks(body):
-    cur_block = []
-
-    for inst in body:
-        if 'op' in inst:
-            cur_block.append(inst)
-
-            # check for term
-            if inst['op'] in TERM:
-                yield cur_block
-                cur_block = []
-
-        else:  # label
-            if len(cur_block) != 0:
-                yield cur_block
-
-            cur_block = [inst]
-
-    if len(cur_block) != 0:
-        yield cur_block
-
-
 class CFG:
     # Constructs a new cfg (names, blocks, edges), where:
     # names: a list of block names
     # blocks: the list of blocks themselves
     # edges: idx->idx map of successors
+    # preds: idx->idx map of predecessors
     def __init__(self, func):
-        self.names = []
+        # Split the instructions into blocks, as in Lesson 2: a label starts
+        # a new block and a terminator ends one.
         self.blocks = []
+        block = []
+        for inst in func['instrs']:
+            if 'label' in inst and block:
+                self.blocks.append(block)
+                block = []
+            block.append(inst)
+            if inst.get('op') in TERM:
+                self.blocks.append(block)
+                block = []
+        if block:
+            self.blocks.append(block)
+        self.n = len(self.blocks)
 
-        # Map label -> block idx for that label
+        # Name each block after its label, or "b<idx>" if it has none, and
+        # map label -> block idx for that label
+        self.names = []
         labels = {}
+        for i, block in enumerate(self.blocks):
+            if 'label' in block[0]:
+                labels[block[0]['label']] = i
+                self.names.append(block[0]['label'])
+            else:
+                self.names.append("b" + str(i))
 
-        # Edges of the CFG
+        # Branches and jumps go to their labels, returns go nowhere, and
+        # anything else falls through to the next block (if there is one)
         self.edges = []
-
-        # When we encounter jumps to labels that haven't appeared yet, add the
-        # label here with a list of blocks that need to jump TO that label
-        # label -> [list of blocks forward-jumping to it]
-        resolve = {}
-
-        def make_edge(idx, label):
-            if label in labels:
-                self.edges[idx].append(labels[label])
+        for i, block in enumerate(self.blocks):
+            op = block[-1].get('op')
+            if op in ('br', 'jmp'):
+                self.edges.append([labels[lab] for lab in block[-1]['labels']])
+            elif op == 'ret' or i == self.n - 1:
+                self.edges.append([])
             else:
-                if label in resolve:
-                    resolve[label].append(idx)
-                else:
-                    resolve[label] = [idx]
-
-        for i, block in enumerate(form_blocks(func['instrs'])):
-
-            self.blocks.append(block)
-            self.edges.append([])
-
-            name = "b" + str(i)
-
-            if 'label' in block[0]:
-                name = block[0]['label']
-                labels[name] = i
-
-            self.names.append(name)
-
-            if 'op' in block[-1] and (block[-1]['op'] == 'br' or
-                                      block[-1]['op'] == 'jmp'):
-                for label in block[-1]['labels']:
-                    make_edge(i, label)
-
-            elif 'op' in block[-1] and block[-1]['op'] != 'ret':
-                self.edges[i] = [i+1]
-
-        self.n = len(self.names)
-
-        for lab, idcs in resolve.items():
-            for idx in idcs:
-                self.edges[idx].append(labels[lab])
-
-        # If we added i+1 for the last block, remove it (there is no successor)
-        if self.n in self.edges[-1]:
-            self.edges[-1] = []
+                self.edges.append([i + 1])
 
         # compute edges_r to get predecessors
-        self.preds = []
-        for i in range(self.n):
-            self.preds.append([])
-
+        self.preds = [[] for _ in range(self.n)]
         for k, v in enumerate(self.edges):
             for d in v:
                 self.preds[d].append(k)
@@ -0,0 +1,204 @@
+"""Performance measurements for the Bril text format tools.
+
+Give a mode and some Bril text files, like this:
+
+    $ python3 bench.py startup ../benchmarks/core/*.bril
+
+Results are written to standard output as CSV, and a short summary goes
+to standard error.
+"""
+
+import csv
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import briltxt
+import briltxt.binary
+
+ARGS_RE = r'ARGS: (.*)'
+
+
+def timed(func, *args, **kwargs):
+    """Call `func` and return the elapsed wall-clock time in seconds.
+    """
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def best(func, *args, repeat=5):
+    """Get the fastest time out of several calls to `func`.
+    """
+    return min(timed(func, *args) for _ in range(repeat))
+
+
+# Run the in-tree `bril2json`, rather than whichever one is on the PATH.
+BRIL2JSON = [
+    sys.executable, '-c',
+    'import sys; sys.path.insert(0, {!r}); import briltxt; '
+    'briltxt.bril2json()'.format(os.path.dirname(os.path.abspath(__file__))),
+]
+
+
+def bench_startup(files):
+    """Measure the cost of getting the LALR parser ready, with and without
+    the on-disk cache of its tables.
+
+    `build` and `load` construct the parser in this process and parse the
+    file, either compiling the grammar or loading the cached tables.
+    `cli_build` and `cli_load` are the same for a whole `bril2json`
+    process: the first run gets an empty cache directory, so it compiles
+    the grammar (and writes the cache), and the second run loads it.
+    """
+    columns = ['build', 'load', 'cli_build', 'cli_load']
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['file'] + columns)
+
+    # Keep this process's cache apart from the real one, and fill it.
+    os.environ['XDG_CACHE_HOME'] = tempfile.mkdtemp()
+    get_parser = briltxt.get_parser.__wrapped__  # Skip the memoization.
+    get_parser()
+
+    totals = {c: [] for c in columns}
+    for fn in files:
+        with open(fn) as f:
+            txt = f.read()
+
+        times = {
+            'build': timed(lambda: get_parser(disk_cache=False).parse(txt)),
+            'load': timed(lambda: get_parser().parse(txt)),
+        }
+        env = dict(os.environ, XDG_CACHE_HOME=tempfile.mkdtemp())
+        for c in ('cli_build', 'cli_load'):
+            times[c] = timed(
+                subprocess.run, BRIL2JSON, input=txt, text=True, env=env,
+                stdout=subprocess.DEVNULL, check=True,
+            )
+        shutil.rmtree(env['XDG_CACHE_HOME'])
+
+        for c in columns:
+            totals[c].append(times[c])
+        writer.writerow([fn] + [times[c] for c in columns])
+    shutil.rmtree(os.environ['XDG_CACHE_HOME'])
+
+    for key, ts in totals.items():
+        print('{}: mean {:.2f} ms, total {:.2f} s'.format(
+            key, statistics.mean(ts) * 1000, sum(ts),
+        ), file=sys.stderr)
+
+
+def bench_throughput(files):
+    """Measure parsing speed, in instructions per second, for each of the
+    parser algorithms.
+    """
+    algorithms = ['lalr', 'earley']
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['file', 'instrs'] + algorithms)
+
+    total_instrs = 0
+    total_times = {a: 0.0 for a in algorithms}
+    for fn in files:
+        with open(fn) as f:
+            txt = f.read()
+        prog = json.loads(briltxt.parse_bril(txt))
+        instrs = sum(len(func['instrs']) for func in prog['functions'])
+
+        rates = []
+        for algorithm in algorithms:
+            parser = briltxt.get_parser(algorithm)
+            t = timed(parser.parse, txt)
+            total_times[algorithm] += t
+            rates.append(instrs / t)
+        total_instrs += instrs
+        writer.writerow([fn, instrs] + rates)
+
+    for algorithm, t in total_times.items():
+        print('{}: {:.0f} instrs/s'.format(algorithm, total_instrs / t),
+              file=sys.stderr)
+
+
+# `bril2json` options to compare in the `pipeline` mode.
+PIPELINE_OPTIONS = {
+    'default': '',
+    'compact': '--compact',
+}
+
+
+def bench_pipeline(files):
+    """Measure end-to-end `bril2json | brili` time with each of the
+    `bril2json` output options.
+    """
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['file'] + list(PIPELINE_OPTIONS))
+
+    totals = {name: 0.0 for name in PIPELINE_OPTIONS}
+    for fn in files:
+        with open(fn) as f:
+            match = re.search(ARGS_RE, f.read())
+        args = match.group(1) if match else ''
+
+        times = []
+        for name, opts in PIPELINE_OPTIONS.items():
+            cmd = 'bril2json {} < {} | brili -p {}'.format(opts, fn, args)
+            t = timed(
+                subprocess.run, cmd, shell=True, check=True,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            totals[name] += t
+            times.append(t)
+        writer.writerow([fn] + times)
+
+    for name, t in totals.items():
+        print('{}: total {:.2f} s'.format(name, t), file=sys.stderr)
+
+
+def bench_binary(files):
+    """Compare dumping and loading programs in the binary format against
+    JSON. `lazy` loads just the first function from the binary format.
+    """
+    columns = ['json_dump', 'json_load', 'bin_dump', 'bin_load', 'lazy']
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['file', 'json_size', 'bin_size'] + columns)
+
+    totals = {c: 0.0 for c in columns}
+    for fn in files:
+        with open(fn) as f:
+            prog = json.loads(briltxt.parse_bril(f.read()))
+        json_data = json.dumps(prog)
+        bin_data = briltxt.binary.dumps_binary(prog)
+
+        times = {
+            'json_dump': best(json.dumps, prog),
+            'json_load': best(json.loads, json_data),
+            'bin_dump': best(briltxt.binary.dumps_binary, prog),
+            'bin_load': best(briltxt.binary.loads_binary, bin_data),
+            'lazy': best(
+                lambda: briltxt.binary.BinaryProgram(bin_data).function(0)
+            ),
+        }
+        for c in columns:
+            totals[c] += times[c]
+        writer.writerow([fn, len(json_data), len(bin_data)] +
+                        [times[c] for c in columns])
+
+    for c, t in totals.items():
+        print('{}: total {:.2f} ms'.format(c, t * 1000), file=sys.stderr)
+
+
+MODES = {
+    'startup': bench_startup,
+    'throughput': bench_throughput,
+    'pipeline': bench_pipeline,
+    'binary': bench_binary,
+}
+
+
+if __name__ == '__main__':
+    MODES[sys.argv[1]](sys.argv[2:])
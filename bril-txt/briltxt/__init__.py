@@ -0,0 +1,780 @@
+"""A text format for Bril.
+
+This package defines both a parser and a pretty-printer for a
+human-editable representation of Bril programs. There are three
+commands here:
+
+* `bril2json` parses the text format and emits the ordinary JSON
+  representation. Options select compact output, source positions
+  (inline or in a side table), and a streaming mode for huge programs.
+* `bril2txt` takes a Bril program in its (canonical) JSON format and
+  pretty-prints it in the text format.
+* `brilwatch` keeps a JSON copy of a text file up to date as it is
+  edited, re-parsing only the definitions that change.
+
+The `briltxt.binary` module has a binary encoding of Bril's JSON (with
+the `brilpack` and `brilunpack` commands), and `briltxt.convert`
+converts many files at once (`brilconv`).
+"""
+
+import lark
+import sys
+import json
+import functools
+import re
+import os
+import argparse
+import time
+import contextlib
+import tempfile
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__version__ = '0.0.1'
+
+
+# Text format parser.
+
+GRAMMAR = r"""
+start: (struct | func)*
+
+struct: STRUCT IDENT "=" "{" mbr* "}"
+mbr: IDENT ":" type ";"
+
+func: FUNC ["(" arg_list ")"] [tyann] "{" instr* "}"
+arg_list: | arg ("," arg)*
+arg: IDENT ":" type
+?instr: const | vop | eop | label
+
+const.4: IDENT [tyann] "=" "const" lit ";"
+vop.3: IDENT [tyann] "=" op ";"
+eop.2: op ";"
+label.1: LABEL ":"
+
+op: IDENT (FUNC | LABEL | IDENT)*
+
+?tyann: ":" type
+
+lit: SIGNED_INT  -> int
+  | BOOL         -> bool
+  | SIGNED_FLOAT -> float
+  | "nullptr"    -> nullptr
+  | CHAR         -> char
+
+type: IDENT "<" type ">"  -> paramtype
+    | IDENT               -> primtype
+
+BOOL: "true" | "false"
+STRUCT: "struct"
+CHAR:  /'.'/ | /'\\[0abtnvfr]'/
+IDENT: ("_"|"%"|LETTER) ("_"|"%"|"."|LETTER|DIGIT)*
+FUNC: "@" IDENT
+LABEL: "." IDENT
+COMMENT: /#.*/
+
+
+%import common.SIGNED_INT
+%import common.SIGNED_FLOAT
+%import common.WS
+%import common.LETTER
+%import common.DIGIT
+%ignore WS
+%ignore COMMENT
+""".strip()
+
+control_chars = {
+    '\\0': 0,
+    '\\a': 7,
+    '\\b': 8,
+    '\\t': 9,
+    '\\n': 10,
+    '\\v': 11,
+    '\\f': 12,
+    '\\r': 13,
+}
+
+
+class JSONTransformer(lark.Transformer):
+    def __init__(self, include_pos=False, line_offset=0):
+        super().__init__()
+        self.include_pos = include_pos
+        self.line_offset = line_offset
+
+    def _pos(self, token):
+        """Generate a position dict from a Lark token."""
+        return {'row': token.line + self.line_offset, 'col': token.column}
+
+    def start(self, items):
+        structs = [i for i in items if 'mbrs' in i]
+        funcs = [i for i in items if 'mbrs' not in i]
+        if structs:
+            return {
+                'structs': structs,
+                'functions': funcs,
+            }
+        else:
+            return {
+                'functions': funcs,
+            }
+
+    def func(self, items):
+        name, args, typ = items[:3]
+        instrs = items[3:]
+        func = {
+            'name': str(name)[1:],  # Strip `@`.
+            'instrs': instrs,
+        }
+        if args:
+            func['args'] = args
+        if typ:
+            func['type'] = typ
+        if self.include_pos:
+            func['pos'] = self._pos(name)
+        return func
+
+    def arg(self, items):
+        name = items.pop(0)
+        typ = items.pop(0)
+        return {
+            'name': name,
+            'type': typ,
+        }
+
+    def struct(self, items):
+        name = items[1]
+        mbrs = items[2:]
+        return {
+            'name': name,
+            'mbrs': mbrs,
+        }
+
+    def mbr(self, items):
+        name = items.pop(0)
+        typ = items.pop(0)
+        return {
+            'name': name,
+            'type': typ,
+        }
+
+    def arg_list(self, items):
+        return items
+
+    def const(self, items):
+        dest, type, val = items
+        out = {
+            'op': 'const',
+            'dest': str(dest),
+            'value': val,
+        }
+        if type:
+            out['type'] = type
+        if self.include_pos:
+            out['pos'] = self._pos(dest)
+        return out
+
+    def vop(self, items):
+        dest, type, op = items
+        out = {'dest': str(dest)}
+        if type:
+            out['type'] = type
+        out.update(op)
+        if self.include_pos:
+            out['pos'] = self._pos(dest)
+        return out
+
+    def op(self, items):
+        op_token = items.pop(0)
+        opcode = str(op_token)
+
+        funcs = []
+        labels = []
+        args = []
+        for item in items:
+            if item.type == 'FUNC':
+                funcs.append(str(item)[1:])
+            elif item.type == 'LABEL':
+                labels.append(str(item)[1:])
+            else:
+                args.append(str(item))
+
+        out = {'op': opcode}
+        if args:
+            out['args'] = args
+        if funcs:
+            out['funcs'] = funcs
+        if labels:
+            out['labels'] = labels
+        if self.include_pos:
+            out['pos'] = self._pos(op_token)
+        return out
+
+    def eop(self, items):
+        op, = items
+        return op
+
+    def label(self, items):
+        name, = items
+        out = {
+            'label': str(name)[1:]  # Strip `.`.
+        }
+        if self.include_pos:
+            out['pos'] = self._pos(name)
+        return out
+
+    def int(self, items):
+        return int(str(items[0]))
+
+    def bool(self, items):
+        if str(items[0]) == 'true':
+            return True
+        else:
+            return False
+
+    def paramtype(self, items):
+        return {items[0]: items[1]}
+
+    def primtype(self, items):
+        return str(items[0])
+
+    def float(self, items):
+        return float(items[0])
+
+    def nullptr(self, items):
+        return 0
+
+    def char(self, items):
+        value = str(items[0])[1:-1]  # Strip `'`.
+        if value in control_chars:
+            return chr(control_chars[value])
+        return value
+
+
+def _cache_file():
+    """Get the path of the on-disk cache for the LALR parser tables, or
+    None if there is nowhere safe to put it.
+
+    The cache lives in a per-user directory (`$XDG_CACHE_HOME/bril`, or
+    `~/.cache/bril`) that only its owner can access, because Lark
+    unpickles the file when it loads it.
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    path = os.path.join(base, 'bril')
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        st = os.stat(path)
+    except OSError:
+        return None
+    if hasattr(os, 'getuid') and (st.st_uid != os.getuid() or
+                                  st.st_mode & 0o077):
+        return None
+    return os.path.join(path, 'lalr-py{}.{}.lark'.format(
+        *sys.version_info[:2]
+    ))
+
+
+@functools.lru_cache(maxsize=None)
+def get_parser(algorithm='lalr', disk_cache=True):
+    """Get a Lark parser for the text format.
+
+    `algorithm` is either 'lalr' (the fast default) or 'earley' (slower,
+    but tolerant of grammar ambiguity). Building the parser is expensive
+    compared to parsing a typical program, so the parser is constructed
+    once and reused for every subsequent call. Unless `disk_cache` is
+    false, the LALR tables are also cached on disk (see `_cache_file`)
+    so that new processes can skip grammar compilation.
+    """
+    if algorithm == 'lalr':
+        cache = _cache_file() if disk_cache else None
+        if cache:
+            try:
+                return lark.Lark(GRAMMAR, maybe_placeholders=True,
+                                 parser='lalr', lexer='contextual',
+                                 cache=cache)
+            except OSError:
+                # The cache file could not be written; carry on without it.
+                pass
+        return lark.Lark(GRAMMAR, maybe_placeholders=True,
+                         parser='lalr', lexer='contextual')
+    else:
+        return lark.Lark(GRAMMAR, maybe_placeholders=True, parser=algorithm)
+
+
+def dumps(data, compact=False):
+    """Serialize Bril JSON data to a string.
+
+    By default, the output is indented and has sorted keys. In compact
+    mode, it is minified instead, and uses the faster `orjson` library
+    when it is installed.
+    """
+    if not compact:
+        return json.dumps(data, indent=2, sort_keys=True)
+    if orjson:
+        try:
+            return orjson.dumps(data).decode('utf8')
+        except TypeError:
+            pass  # Integers beyond 64 bits, for example.
+    return json.dumps(data, separators=(',', ':'))
+
+
+def _split_func_positions(func):
+    """Remove the `pos` keys from a function and its instructions, and
+    return them as a position table entry (see `split_positions`).
+    """
+    rows = []
+    cols = []
+    for instr in func['instrs']:
+        pos = instr.pop('pos', None)
+        rows.append(pos['row'] if pos else None)
+        cols.append(pos['col'] if pos else None)
+    entry = {'name': func['name'], 'row': rows, 'col': cols}
+    if 'pos' in func:
+        entry['pos'] = func.pop('pos')
+    return entry
+
+
+def split_positions(prog):
+    """Move source positions out of a program and into a side table.
+
+    The `pos` keys are removed from every function and instruction. The
+    returned table is a list parallel to `prog['functions']`. Each entry
+    holds the function's `name` and `pos` and parallel `row` and `col`
+    lists with the position of each item in its `instrs` (or `None` where
+    there was none).
+    """
+    return [_split_func_positions(func) for func in prog['functions']]
+
+
+def _check_pos_options(include_pos, pos_table):
+    if include_pos and pos_table:
+        raise ValueError('positions go either inline or in a table, not both')
+
+
+def parse_bril(txt, include_pos=False, algorithm='lalr', compact=False,
+               pos_table=False):
+    """Parse a Bril program and return a JSON string.
+
+    Optionally include source position information, either inline on
+    each instruction or, with `pos_table`, as a separate `positions`
+    section (see `split_positions`). `algorithm` selects the parser (see
+    `get_parser`), and `compact` the output style (see `dumps`).
+    """
+    _check_pos_options(include_pos, pos_table)
+    tree = get_parser(algorithm).parse(txt)
+    data = JSONTransformer(include_pos or pos_table).transform(tree)
+    if pos_table:
+        data['positions'] = split_positions(data)
+    return dumps(data, compact)
+
+
+# Braces, along with the comments and character literals that might
+# contain braces that don't count.
+BRACE_RE = re.compile(r"'\\?.'|#.*|[{}]")
+
+
+def split_toplevel(lines):
+    """Group lines of Bril text into chunks of complete top-level
+    definitions (functions and structs).
+
+    Generate `(lineno, text)` pairs, where `lineno` is the number of the
+    chunk's first line in the whole input. A chunk usually holds a single
+    definition, but definitions that share a line stay together.
+    """
+    chunk = []
+    start = 1
+    depth = 0
+    for lineno, line in enumerate(lines, 1):
+        if not chunk:
+            start = lineno
+        chunk.append(line)
+
+        closed = False
+        for match in BRACE_RE.finditer(line):
+            if match.group() == '{':
+                depth += 1
+            elif match.group() == '}':
+                depth -= 1
+                closed = depth == 0
+
+        if closed and depth == 0:
+            yield start, ''.join(chunk)
+            chunk = []
+
+    if chunk:
+        yield start, ''.join(chunk)
+
+
+def _indent(text, prefix):
+    """Indent all but the first line of `text`."""
+    return text.replace('\n', '\n' + prefix)
+
+
+def _list_pieces(texts, compact=False):
+    """Generate the text of a list that is a top-level section of a
+    program's JSON, given the serialized text of each item.
+    """
+    first = True
+    yield '['
+    for text in texts:
+        if compact:
+            yield text if first else ',' + text
+        else:
+            yield ('\n    ' if first else ',\n    ') + _indent(text, '    ')
+        first = False
+    yield ']' if compact or first else '\n  ]'
+
+
+def _sections(positions, structs, pos_table, compact=False):
+    """List the top-level sections, besides `functions`, of a program's
+    JSON as (key, item texts) pairs in sorted order. `positions` holds
+    the position table entries already serialized with `dumps`.
+    """
+    sections = []
+    if pos_table:
+        sections.append(('positions', positions))
+    if structs:
+        sections.append(('structs', (dumps(s, compact) for s in structs)))
+    return sections
+
+
+def _json_pieces(func_texts, get_sections, compact=False):
+    """Generate the text of a program's JSON in pieces.
+
+    `func_texts` are the program's functions, already serialized with
+    `dumps`. `get_sections` is called once they have all been consumed,
+    and returns the remaining top-level sections (see `_sections`).
+    """
+    yield '{"functions":' if compact else '{\n  "functions": '
+    yield from _list_pieces(func_texts, compact)
+    for key, texts in get_sections():
+        yield ',"{}":'.format(key) if compact else ',\n  "{}": '.format(key)
+        yield from _list_pieces(texts, compact)
+    yield '}\n' if compact else '\n}\n'
+
+
+def stream_bril(lines, out, include_pos=False, algorithm='lalr',
+                compact=False, pos_table=False):
+    """Parse a Bril program one top-level definition at a time, writing
+    the JSON for each function to `out` as soon as it is parsed.
+
+    The output is identical to `parse_bril`'s, but memory use is bounded
+    by the largest function rather than the whole program. Structs are
+    small, so they are held back until the end to keep keys sorted. The
+    position table grows with the program, so its entries are spooled to
+    a temporary file instead and copied out at the end.
+    """
+    _check_pos_options(include_pos, pos_table)
+    parser = get_parser(algorithm)
+    structs = []
+
+    with (tempfile.TemporaryFile('w+') if pos_table
+          else contextlib.nullcontext()) as spool:
+        def func_texts():
+            for lineno, chunk in split_toplevel(lines):
+                tree = parser.parse(chunk)
+                data = JSONTransformer(include_pos or pos_table,
+                                       lineno - 1).transform(tree)
+                structs.extend(data.get('structs', []))
+                for func in data['functions']:
+                    if pos_table:
+                        entry = _split_func_positions(func)
+                        spool.write(json.dumps(entry) + '\n')
+                    yield dumps(func, compact)
+
+        def positions():
+            spool.seek(0)
+            for line in spool:
+                yield dumps(json.loads(line), compact)
+
+        pieces = _json_pieces(
+            func_texts(),
+            lambda: _sections(positions(), structs, pos_table, compact),
+            compact,
+        )
+        for piece in pieces:
+            out.write(piece)
+
+
+class _Chunk:
+    """The parsed form of one chunk of text from `split_toplevel`, for
+    reuse by `IncrementalParser`.
+    """
+    def __init__(self, lineno, data, positions, compact):
+        self.lineno = lineno
+        self.funcs = data['functions']
+        self.structs = data.get('structs', [])
+        self.positions = positions
+        self.compact = compact
+        self.func_texts = [dumps(f, compact) for f in self.funcs]
+
+    def move(self, lineno):
+        """Shift all the source positions so the chunk starts at line
+        `lineno`.
+        """
+        delta = lineno - self.lineno
+        self.lineno = lineno
+        for func in self.funcs:
+            for obj in [func] + func['instrs']:
+                if 'pos' in obj:
+                    obj['pos']['row'] += delta
+        for entry in self.positions:
+            entry['pos']['row'] += delta
+            entry['row'] = [r if r is None else r + delta
+                            for r in entry['row']]
+        self.func_texts = [dumps(f, self.compact) for f in self.funcs]
+
+
+class IncrementalParser:
+    """Parse successive versions of a Bril program, re-parsing only the
+    top-level definitions whose text changed since the previous version.
+
+    Definitions that merely moved to different lines are reused, with
+    their source positions shifted. The options are the same as for
+    `parse_bril`.
+    """
+    def __init__(self, include_pos=False, algorithm='lalr', compact=False,
+                 pos_table=False):
+        _check_pos_options(include_pos, pos_table)
+        self.parser = get_parser(algorithm)
+        self.include_pos = include_pos
+        self.compact = compact
+        self.pos_table = pos_table
+        self.cache = {}  # Chunk text to `_Chunk`.
+        self.reparsed = 0
+        self.total = 0
+
+    def _parse_chunk(self, lineno, chunk):
+        tree = self.parser.parse(chunk)
+        with_pos = self.include_pos or self.pos_table
+        data = JSONTransformer(with_pos, lineno - 1).transform(tree)
+        positions = split_positions(data) if self.pos_table else []
+        return _Chunk(lineno, data, positions, self.compact)
+
+    def parse(self, txt):
+        """Parse a new version of the program and return its JSON string.
+
+        Afterward, `reparsed` and `total` hold the number of chunks that
+        had to be parsed and the number of chunks in the program.
+        """
+        cache = {}
+        chunks = []
+        self.reparsed = 0
+        for lineno, text in split_toplevel(txt.splitlines(keepends=True)):
+            # Each old chunk can only be reused once.
+            chunk = self.cache.pop(text, None)
+            if chunk is None:
+                chunk = self._parse_chunk(lineno, text)
+                self.reparsed += 1
+            elif chunk.lineno != lineno and \
+                    (self.include_pos or self.pos_table):
+                chunk.move(lineno)
+            cache[text] = chunk
+            chunks.append(chunk)
+        self.cache = cache
+        self.total = len(chunks)
+
+        return ''.join(_json_pieces(
+            (text for chunk in chunks for text in chunk.func_texts),
+            lambda: _sections(
+                (dumps(e, self.compact)
+                 for chunk in chunks for e in chunk.positions),
+                [s for chunk in chunks for s in chunk.structs],
+                self.pos_table,
+                self.compact,
+            ),
+            self.compact,
+        ))
+
+
+# Text format pretty-printer.
+
+# Escape sequences for control characters, keyed by the character.
+control_chars_reverse = {chr(v): k for k, v in control_chars.items()}
+
+
+def type_to_str(type):
+    if isinstance(type, dict):
+        assert len(type) == 1
+        key, value = next(iter(type.items()))
+        return '{}<{}>'.format(key, type_to_str(value))
+    else:
+        return type
+
+
+def value_to_str(type, value):
+    if not isinstance(type, dict) and type.lower() == "char":
+        return "'{}'".format(control_chars_reverse.get(value, value))
+    else:
+        return str(value).lower()
+
+
+def instr_to_string(instr):
+    if instr['op'] == 'const':
+        rhs = 'const ' + value_to_str(instr['type'], instr['value'])
+    else:
+        parts = [instr['op']]
+        funcs = instr.get('funcs')
+        if funcs:
+            parts += ['@' + f for f in funcs]
+        args = instr.get('args')
+        if args:
+            parts += args
+        labels = instr.get('labels')
+        if labels:
+            parts += ['.' + label for label in labels]
+        rhs = ' '.join(parts)
+
+    if 'dest' in instr:
+        if 'type' in instr:
+            return '{}: {} = {}'.format(
+                instr['dest'],
+                type_to_str(instr['type']),
+                rhs,
+            )
+        return '{} = {}'.format(instr['dest'], rhs)
+    else:
+        return rhs
+
+
+def args_to_string(args):
+    if args:
+        return '({})'.format(', '.join(
+            '{}: {}'.format(arg['name'], type_to_str(arg['type']))
+            for arg in args
+        ))
+    else:
+        return ''
+
+
+def _func_lines(func, lines):
+    """Append the lines of a function's text to the list `lines`."""
+    typ = func.get('type', 'void')
+    lines.append('@{}{}{} {{'.format(
+        func['name'],
+        args_to_string(func.get('args', [])),
+        ': {}'.format(type_to_str(typ)) if typ != 'void' else '',
+    ))
+    for instr_or_label in func['instrs']:
+        if 'label' in instr_or_label:
+            lines.append('.' + instr_or_label['label'] + ':')
+        else:
+            lines.append('  ' + instr_to_string(instr_or_label) + ';')
+    lines.append('}')
+
+
+def func_to_string(func):
+    """Pretty-print a function as text (with no trailing newline)."""
+    lines = []
+    _func_lines(func, lines)
+    return '\n'.join(lines)
+
+
+def prog_to_string(prog):
+    """Pretty-print a whole program as text.
+
+    The program is assembled into a single string, which is much faster
+    than printing it piece by piece.
+    """
+    lines = []
+    for func in prog['functions']:
+        _func_lines(func, lines)
+    lines.append('')  # Trailing newline.
+    return '\n'.join(lines)
+
+
+def print_instr(instr):
+    print('  {};'.format(instr_to_string(instr)))
+
+
+def print_label(label):
+    print('.{}:'.format(label['label']))
+
+
+def print_func(func):
+    print(func_to_string(func))
+
+
+def print_prog(prog):
+    sys.stdout.write(prog_to_string(prog))
+
+
+# Command-line entry points.
+
+def bril2json():
+    include_pos = '-p' in sys.argv[1:]
+    algorithm = 'earley' if '--earley' in sys.argv[1:] else 'lalr'
+    compact = '--compact' in sys.argv[1:]
+    pos_table = '--pos-table' in sys.argv[1:]
+    if include_pos and pos_table:
+        sys.exit('bril2json: -p and --pos-table cannot be used together')
+    if '--stream' in sys.argv[1:]:
+        stream_bril(sys.stdin, sys.stdout, include_pos, algorithm, compact,
+                    pos_table)
+    else:
+        print(parse_bril(sys.stdin.read(), include_pos, algorithm, compact,
+                         pos_table))
+
+
+def bril2txt():
+    sys.stdout.write(prog_to_string(json.load(sys.stdin)))
+
+
+def brilwatch():
+    parser = argparse.ArgumentParser(
+        description='Watch a Bril text file and keep a JSON copy of it up '
+                    'to date, re-parsing only the functions that change.',
+    )
+    parser.add_argument('file', metavar='FILE', help='Bril text file')
+    parser.add_argument('-o', '--output',
+                        help='JSON output file (default: FILE with .json)')
+    parser.add_argument('-i', '--interval', type=float, default=0.1,
+                        help='seconds between checks for changes')
+    pos = parser.add_mutually_exclusive_group()
+    pos.add_argument('-p', dest='include_pos', action='store_true',
+                     help='include source positions')
+    pos.add_argument('--pos-table', action='store_true',
+                     help='put source positions in a side table')
+    parser.add_argument('--compact', action='store_true',
+                        help='emit minified JSON')
+    args = parser.parse_args()
+    out_path = args.output or os.path.splitext(args.file)[0] + '.json'
+
+    inc = IncrementalParser(
+        include_pos=args.include_pos,
+        compact=args.compact,
+        pos_table=args.pos_table,
+    )
+    mtime = None
+    try:
+        while True:
+            try:
+                new_mtime = os.stat(args.file).st_mtime_ns
+            except FileNotFoundError:
+                new_mtime = None
+            if new_mtime is not None and new_mtime != mtime:
+                mtime = new_mtime
+                with open(args.file) as f:
+                    txt = f.read()
+
+                start = time.perf_counter()
+                try:
+                    data = inc.parse(txt)
+                except lark.exceptions.LarkError as exc:
+                    print('{}: {}'.format(args.file, exc), file=sys.stderr)
+                else:
+                    # Replace the output atomically so readers never see
+                    # a partial file.
+                    tmp_path = out_path + '.tmp'
+                    with open(tmp_path, 'w') as out:
+                        out.write(data)
+                    os.replace(tmp_path, out_path)
+                    print('{}: re-parsed {} of {} in {:.1f} ms'.format(
+                        out_path, inc.reparsed, inc.total,
+                        (time.perf_counter() - start) * 1000,
+                    ), file=sys.stderr)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,328 @@
+"""A binary encoding of Bril programs.
+
+A compact encoding of the JSON representation. Names, types, and
+constant values are interned in a string table. Each function's
+instructions are packed into fixed-size records that refer to the
+table, with the variable-length operand lists (args, funcs, and
+labels) in a separate array. Anything else, such as `pos` or unknown
+keys, is kept as embedded JSON text, so conversion is lossless.
+
+The layout, with all integers little-endian, is:
+
+* A header: the magic bytes `BRLB`, then five u32s: the format
+  version, the string index of the other top-level keys (such as
+  `structs`) as a JSON object, the string count, and the function
+  count.
+* The string table: count + 1 u32 offsets, then the UTF-8 data.
+* The function directory: for each function, a u64 file offset and
+  u32 name string index, instruction count, and operand count.
+* The functions: for each, a u32 JSON string index for the fields
+  other than `name` and `instrs`, the instruction records, and the
+  u32 operand array. Each record has u16 flags and u16 counts of args,
+  funcs, and labels, then u32s: the string indices of the op (or
+  label), dest, JSON type, and JSON value, the position of the
+  instruction's first operand in the operand array (its args, funcs,
+  and labels are consecutive there), and the string index of any other
+  fields as a JSON object.
+
+An absent string index is 0xffffffff.
+
+`brilpack` and `brilunpack` convert between this format and JSON.
+"""
+
+import contextlib
+import json
+import mmap
+import struct
+import sys
+
+from . import dumps
+
+BIN_MAGIC = b'BRLB'
+BIN_VERSION = 1
+BIN_NONE = 0xffffffff  # An absent string index.
+
+_BIN_HEADER = struct.Struct('<4sIIII')
+_BIN_DIR = struct.Struct('<QIII')
+_BIN_INSTR = struct.Struct('<4H6I')
+_BIN_U32 = struct.Struct('<I')
+
+# Flags for the fields present in an instruction record.
+_HAS_OP = 1 << 0
+_HAS_DEST = 1 << 1
+_HAS_TYPE = 1 << 2
+_HAS_VALUE = 1 << 3
+_HAS_ARGS = 1 << 4
+_HAS_FUNCS = 1 << 5
+_HAS_LABELS = 1 << 6
+_HAS_EXTRA = 1 << 7
+_IS_LABEL = 1 << 8
+
+
+def _is_names(value):
+    return isinstance(value, list) and len(value) <= 0xffff and \
+        all(isinstance(v, str) for v in value)
+
+
+class _BinaryWriter:
+    """Accumulate the string table and function bodies for
+    `dumps_binary`.
+    """
+    def __init__(self):
+        self.strings = {}
+
+    def intern(self, string):
+        index = self.strings.get(string)
+        if index is None:
+            index = self.strings[string] = len(self.strings)
+        return index
+
+    def intern_json(self, value):
+        return self.intern(json.dumps(value))
+
+    def instr(self, instr, operands):
+        """Pack one instruction into a record, appending to `operands`."""
+        instr = dict(instr)
+        flags = 0
+        counts = [0, 0, 0]
+        op = dest = typ = value = extra = BIN_NONE
+        start = len(operands)
+
+        if isinstance(instr.get('op'), str):
+            flags |= _HAS_OP
+            op = self.intern(instr.pop('op'))
+        elif isinstance(instr.get('label'), str):
+            flags |= _IS_LABEL
+            op = self.intern(instr.pop('label'))
+        if isinstance(instr.get('dest'), str):
+            flags |= _HAS_DEST
+            dest = self.intern(instr.pop('dest'))
+        if 'type' in instr:
+            flags |= _HAS_TYPE
+            typ = self.intern_json(instr.pop('type'))
+        if 'value' in instr:
+            flags |= _HAS_VALUE
+            value = self.intern_json(instr.pop('value'))
+        for i, (key, flag) in enumerate([('args', _HAS_ARGS),
+                                         ('funcs', _HAS_FUNCS),
+                                         ('labels', _HAS_LABELS)]):
+            if _is_names(instr.get(key)):
+                flags |= flag
+                names = instr.pop(key)
+                counts[i] = len(names)
+                operands += [self.intern(n) for n in names]
+        if instr:
+            flags |= _HAS_EXTRA
+            extra = self.intern_json(instr)
+
+        return _BIN_INSTR.pack(flags, *counts, op, dest, typ, value, start,
+                               extra)
+
+    def func(self, func):
+        """Pack a function. Return its directory entry (without the
+        offset) and its body.
+        """
+        info = {k: v for k, v in func.items() if k not in ('name', 'instrs')}
+        name = BIN_NONE
+        if isinstance(func.get('name'), str):
+            name = self.intern(func['name'])
+        elif 'name' in func:
+            info['name'] = func['name']
+
+        operands = []
+        records = [self.instr(i, operands) for i in func['instrs']]
+        body = b''.join([
+            _BIN_U32.pack(self.intern_json(info) if info else BIN_NONE),
+            b''.join(records),
+            struct.pack('<{}I'.format(len(operands)), *operands),
+        ])
+        return (name, len(records), len(operands)), body
+
+
+def dumps_binary(prog):
+    """Encode a Bril program (as JSON data) in the binary format and
+    return the bytes.
+    """
+    writer = _BinaryWriter()
+    top = {k: v for k, v in prog.items() if k != 'functions'}
+    top_index = writer.intern_json(top) if top else BIN_NONE
+    funcs = [writer.func(f) for f in prog['functions']]
+
+    # The string table.
+    blobs = [s.encode('utf8') for s in writer.strings]
+    offsets = [0]
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    string_table = struct.pack('<{}I'.format(len(offsets)), *offsets) + \
+        b''.join(blobs)
+
+    # The function directory, which points just past itself.
+    offset = _BIN_HEADER.size + len(string_table) + \
+        _BIN_DIR.size * len(funcs)
+    directory = []
+    for entry, body in funcs:
+        directory.append(_BIN_DIR.pack(offset, *entry))
+        offset += len(body)
+
+    return b''.join([
+        _BIN_HEADER.pack(BIN_MAGIC, BIN_VERSION, top_index,
+                         len(blobs), len(funcs)),
+        string_table,
+        b''.join(directory),
+        b''.join(body for _, body in funcs),
+    ])
+
+
+class _StringTable(dict):
+    """The string table of a binary program, decoding each entry the
+    first time it is looked up.
+    """
+    def __init__(self, data, offsets_at, blob_at):
+        super().__init__()
+        self.data = data
+        self.offsets_at = offsets_at
+        self.blob_at = blob_at
+
+    def __missing__(self, index):
+        start, end = struct.unpack_from(
+            '<II', self.data, self.offsets_at + 4 * index,
+        )
+        string = self[index] = bytes(
+            self.data[self.blob_at + start:self.blob_at + end]
+        ).decode('utf8')
+        return string
+
+
+class _JSONTable(dict):
+    """Decoded JSON values from a string table. Mutable values are decoded
+    afresh every time so that they are never shared.
+    """
+    def __init__(self, strings):
+        super().__init__()
+        self.strings = strings
+
+    def __missing__(self, index):
+        value = json.loads(self.strings[index])
+        if not isinstance(value, (dict, list)):
+            self[index] = value
+        return value
+
+
+class BinaryProgram:
+    """A Bril program in the binary format, decoded lazily.
+
+    `data` is any buffer, such as `bytes` or an `mmap`. Only the header
+    and function directory are read up front. Strings are decoded the
+    first time they are used and functions each time they are requested,
+    so looking at one function does not decode the whole program.
+    """
+    def __init__(self, data):
+        self.data = data
+        magic, version, self._top, n_strings, n_funcs = \
+            _BIN_HEADER.unpack_from(data, 0)
+        if magic != BIN_MAGIC or version != BIN_VERSION:
+            raise ValueError('not a binary Bril program (version {})'
+                             .format(BIN_VERSION))
+
+        offsets_at = _BIN_HEADER.size
+        blob_at = offsets_at + 4 * (n_strings + 1)
+        blob_len, = _BIN_U32.unpack_from(data, blob_at - 4)
+        self.strings = _StringTable(data, offsets_at, blob_at)
+        self._values = _JSONTable(self.strings)
+
+        dir_at = blob_at + blob_len
+        self._dir = [_BIN_DIR.unpack_from(data, dir_at + _BIN_DIR.size * i)
+                     for i in range(n_funcs)]
+
+    def __len__(self):
+        return len(self._dir)
+
+    @property
+    def names(self):
+        """The names of all the functions, in order."""
+        return [None if name == BIN_NONE else self.strings[name]
+                for _, name, _, _ in self._dir]
+
+    def function(self, index):
+        """Decode one function, given its position in the program."""
+        strings = self.strings
+        values = self._values
+        offset, name, n_instrs, n_operands = self._dir[index]
+        info, = _BIN_U32.unpack_from(self.data, offset)
+        func = {} if name == BIN_NONE else {'name': strings[name]}
+        if info != BIN_NONE:
+            func.update(values[info])
+
+        ops_at = offset + 4 + _BIN_INSTR.size * n_instrs
+        operands = [strings[i] for i in struct.unpack_from(
+            '<{}I'.format(n_operands), self.data, ops_at,
+        )]
+
+        instrs = func['instrs'] = []
+        with memoryview(self.data)[offset + 4:ops_at] as records:
+            for flags, n_args, n_funcs, n_labels, op, dest, typ, value, \
+                    start, extra in _BIN_INSTR.iter_unpack(records):
+                if flags & _IS_LABEL:
+                    instr = {'label': strings[op]}
+                elif flags & _HAS_OP:
+                    instr = {'op': strings[op]}
+                else:
+                    instr = {}
+                if flags & _HAS_DEST:
+                    instr['dest'] = strings[dest]
+                if flags & _HAS_TYPE:
+                    instr['type'] = values[typ]
+                if flags & _HAS_VALUE:
+                    instr['value'] = values[value]
+                if flags & _HAS_ARGS:
+                    instr['args'] = operands[start:start + n_args]
+                    start += n_args
+                if flags & _HAS_FUNCS:
+                    instr['funcs'] = operands[start:start + n_funcs]
+                    start += n_funcs
+                if flags & _HAS_LABELS:
+                    instr['labels'] = operands[start:start + n_labels]
+                if flags & _HAS_EXTRA:
+                    instr.update(values[extra])
+                instrs.append(instr)
+        return func
+
+    def lookup(self, name):
+        """Decode the function with the given name."""
+        return self.function(self.names.index(name))
+
+    def functions(self):
+        """Generate all the decoded functions."""
+        for i in range(len(self)):
+            yield self.function(i)
+
+    def to_json(self):
+        """Decode the whole program to its JSON data."""
+        prog = {'functions': list(self.functions())}
+        if self._top != BIN_NONE:
+            prog.update(self._values[self._top])
+        return prog
+
+
+def loads_binary(data):
+    """Decode a whole program from the binary format."""
+    return BinaryProgram(data).to_json()
+
+
+@contextlib.contextmanager
+def open_binary(path):
+    """Memory-map a binary Bril file as a `BinaryProgram`."""
+    with open(path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        yield BinaryProgram(data)
+
+
+# Command-line entry points.
+
+def brilpack():
+    sys.stdout.buffer.write(dumps_binary(json.load(sys.stdin)))
+
+
+def brilunpack():
+    compact = '--compact' in sys.argv[1:]
+    print(dumps(loads_binary(sys.stdin.buffer.read()), compact))
@@ -0,0 +1,189 @@
+"""Batch conversion between the Bril text and JSON formats.
+
+`brilconv` converts many files in one process (or a pool of them), so
+the parser is only built once.
+"""
+
+import argparse
+import functools
+import glob
+import json
+import os
+import re
+import sys
+from concurrent import futures
+
+from . import parse_bril, prog_to_string
+
+# Characters that make part of a path into a glob pattern.
+GLOB_MAGIC_RE = re.compile(r'[*?[]')
+
+
+def output_path(path, outdir=None, root=None):
+    """Get the path to write the conversion of a file to.
+
+    `.json` files are converted to text and anything else to JSON, so the
+    output goes next to the input with the extension swapped. If `outdir`
+    is given, the output goes there instead, at the same path relative to
+    `outdir` as the input has relative to `root` (by default, the input's
+    own directory).
+    """
+    base, ext = os.path.splitext(path)
+    if outdir:
+        if root is None:
+            root = os.path.dirname(path)
+        base = os.path.join(outdir, os.path.relpath(base, root or os.curdir))
+    return base + ('.bril' if ext == '.json' else '.json')
+
+
+def convert_file(path, out_path, include_pos=False, compact=False):
+    """Convert a single file between the text and JSON formats.
+
+    `.json` files are pretty-printed as text and anything else is parsed
+    to JSON. The result is written to `out_path`.
+    """
+    to_txt = out_path.endswith('.bril')
+    with open(path) as f:
+        if to_txt:
+            prog = json.load(f)
+        else:
+            data = parse_bril(f.read(), include_pos, compact=compact)
+    os.makedirs(os.path.dirname(out_path) or os.curdir, exist_ok=True)
+    with open(out_path, 'w') as out:
+        if to_txt:
+            out.write(prog_to_string(prog))
+        else:
+            out.write(data + '\n')
+
+
+def _try_convert(paths, **kwargs):
+    """Convert a file, returning an error message instead of raising."""
+    path, out_path = paths
+    try:
+        convert_file(path, out_path, **kwargs)
+    except Exception as exc:
+        return '{}: {}'.format(path, exc)
+
+
+def _glob_root(pattern):
+    """Get the directory a glob pattern starts from: the longest prefix of
+    it with no wildcards.
+    """
+    root = os.path.dirname(pattern)
+    while GLOB_MAGIC_RE.search(root):
+        root = os.path.dirname(root)
+    return root
+
+
+def expand_paths(patterns):
+    """Expand a list of file names and (recursive) glob patterns.
+
+    Return a list of `(path, root)` pairs, where `root` is the directory
+    the pattern started from (see `output_path`). A plain file name is its
+    own pattern, so its root is the directory it is in.
+    """
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True))
+        root = _glob_root(pattern)
+        paths += [(m, root) for m in matches] if matches else \
+            [(pattern, root)]
+    return paths
+
+
+def plan_outputs(paths, outdir=None):
+    """Pair each input from `expand_paths` with its output path.
+
+    Return a list of `(path, out_path)` pairs, with repeated inputs
+    dropped, and a list of error messages for outputs that would
+    overwrite an input or the output of another input.
+    """
+    inputs = {os.path.realpath(path) for path, _ in paths}
+    seen = set()
+    outputs = {}  # Real path of each output to the input that makes it.
+    plan = []
+    errors = []
+    for path, root in paths:
+        real = os.path.realpath(path)
+        if real in seen:
+            continue
+        seen.add(real)
+        out_path = output_path(path, outdir, root)
+        key = os.path.realpath(out_path)
+        if key in inputs:
+            errors.append('{}: output {} is also an input'.format(
+                path, out_path,
+            ))
+        elif key in outputs:
+            errors.append('{}: output {} is also the output for {}'.format(
+                path, out_path, outputs[key],
+            ))
+        else:
+            outputs[key] = path
+            plan.append((path, out_path))
+    return plan, errors
+
+
+def convert_files(plan, jobs=1, **kwargs):
+    """Convert many files (see `convert_file`) in a single process, or
+    spread across a pool of `jobs` worker processes. `jobs=None` uses one
+    worker per CPU. `plan` is a list of `(path, out_path)` pairs, like
+    the one from `plan_outputs`.
+
+    Return a list of error messages for the files that failed.
+    """
+    convert = functools.partial(_try_convert, **kwargs)
+    if jobs == 1:
+        results = map(convert, plan)
+        return [err for err in results if err]
+    with futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = pool.map(convert, plan, chunksize=8)
+        return [err for err in results if err]
+
+
+# Command-line entry point.
+
+def _jobs(text):
+    """Parse a `-j` value, which must be a non-negative integer.
+    """
+    try:
+        jobs = int(text)
+    except ValueError:
+        jobs = -1
+    if jobs < 0:
+        raise argparse.ArgumentTypeError(
+            'expected a number of jobs (0 or more), got {!r}'.format(text)
+        )
+    return jobs
+
+
+def brilconv():
+    parser = argparse.ArgumentParser(
+        description='Convert many Bril files between the text (.bril) and '
+                    'JSON (.json) formats in one process.',
+    )
+    parser.add_argument('files', metavar='FILE', nargs='+',
+                        help='input files or glob patterns')
+    parser.add_argument('-o', '--outdir',
+                        help='write outputs here instead of next to inputs')
+    parser.add_argument('-j', '--jobs', type=_jobs, default=1,
+                        help='worker processes to use (0: one per CPU)')
+    parser.add_argument('-p', dest='include_pos', action='store_true',
+                        help='include source positions in JSON')
+    parser.add_argument('--compact', action='store_true',
+                        help='emit minified JSON')
+    args = parser.parse_args()
+
+    # Refuse to start if any file would be written twice or overwrite an
+    # input, since the workers would race to write it.
+    plan, errors = plan_outputs(expand_paths(args.files), args.outdir)
+    if not errors:
+        errors = convert_files(
+            plan,
+            jobs=args.jobs or None,
+            include_pos=args.include_pos,
+            compact=args.compact,
+        )
+    for err in errors:
+        print(err, file=sys.stderr)
+    sys.exit(1 if errors else 0)
@@ -1,5 +1,9 @@
 import json
 import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / "examples"))
+from array_cfg import CFG, labeled_blocks
 
 terminators = ('br', 'jmp', 'ret')
 
@@ -7,24 +11,7 @@ def function_blocks(function_instrs):
   """
   Get a list of (label, block) tuples from a list of instructions in a function.
   """
-  cur_block = (None, [])
-  all_blocks = [cur_block]
-  for instr in function_instrs:
-    if "op" in instr:
-      cur_block[1].append(instr)
-      if(instr["op"] in terminators):
-        cur_block = (None, [])
-        all_blocks.append(cur_block)
-    else:
-      # blocks that are empty and have no labels can safely be removed 
-      if(len(cur_block[1]) == 0 and cur_block[0] == None):
-        all_blocks = all_blocks[:-1]
-      cur_block = (instr["label"], [])
-      all_blocks.append(cur_block)
-  # remove empty last block  
-  if(len(cur_block[1]) == 0 and cur_block[0] == None):
-        all_blocks = all_blocks[:-1]
-  return all_blocks
+  return labeled_blocks(CFG(function_instrs))
 
 def blocks(filename):
   with open(filename) as file:
@@ -2,7 +2,9 @@ import sys
 from pathlib import Path
 
 sys.path.append(str(Path(__file__).resolve().parent.parent))
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent / "examples"))
 import lesson_2.blocks as blocks
+from array_cfg import CFG
     
 def change_labels(all_blocks):
   new_name = "b"
@@ -19,30 +21,13 @@ def change_labels(all_blocks):
   return all_blocks
 
 def build_cfg(all_blocks):
-  successors = {"entry": [], "exit": []}
-  for block in all_blocks:
-    successors[block[0]] = []
-  # dummy entry block
-  successors["entry"] = [all_blocks[0][0]]
-  
-  for i in range(len(all_blocks)):
-    # last entry is ret -> successor = exit
-    # last entry is br -> successors = br targets
-    # last entry is jmp -> successor = jmp
-    # last entry is nothing -> successor = next block (or exit if last block)
-    if(len(all_blocks[i][1]) == 0):
-      last_entry = {"op": "fake command"}
-    else:
-      last_entry = all_blocks[i][1][-1]
-    if(last_entry["op"] == "br" or last_entry["op"] == "jmp"):
-      successors[all_blocks[i][0]] = last_entry["labels"]
-    elif(last_entry["op"] == "ret"):
-      successors[all_blocks[i][0]] = ["exit"]
-    else:
-      if(i == len(all_blocks) - 1):
-        successors[all_blocks[i][0]] = ["exit"]
-      else:
-        successors[all_blocks[i][0]] = [all_blocks[i + 1][0]]  
+  # the shared CFG finds the edges; blocks that return or fall off the end
+  # go to a dummy exit block
+  cfg = CFG(blocks.merge_blocks(all_blocks))
+  names = [block[0] for block in all_blocks]
+  successors = {"entry": [names[0]], "exit": []}
+  for i in range(cfg.n):
+    successors[names[i]] = [names[s] for s in cfg.successors(i)] or ["exit"]
   return successors
 
 def remove_orphans(all_blocks, cfg):
@@ -0,0 +1,275 @@
+"""Control flow graphs for Bril functions, stored in flat integer arrays.
+
+Blocks are numbered densely from 0 in program order. Each block is a range
+of indices into the function's own instruction list (so no instructions
+are copied), and the edges are stored in compressed sparse row (CSR) form:
+the successors of block `b` are `succ[succ_start[b]:succ_start[b + 1]]`,
+and likewise for predecessors. Analyses can then work with block numbers
+and lists indexed by them instead of dicts keyed by block names.
+
+The functions at the bottom of this file convert a `CFG` into the
+name-based structures that older code uses, like the block maps and edge
+dicts from `cfg.py`.
+"""
+import json
+import sys
+from array import array
+from collections import OrderedDict
+
+# Instructions that terminate a basic block.
+TERMINATORS = 'br', 'jmp', 'ret'
+
+
+def block_ranges(instrs):
+    """Generate a (start, end) index range for each basic block in a list
+    of Bril instructions, in order.
+
+    Every instruction is in exactly one block. Jump and branch
+    instructions may only appear at the end of a block, and control can
+    transfer only to the top of a block, so labels can only appear at the
+    *start* of a block. Blocks are never empty.
+    """
+    start = None  # The start of the current block, if there is one.
+    for i, instr in enumerate(instrs):
+        if 'op' in instr:
+            # An instruction joins the current block (or starts one), and
+            # a terminator ends it.
+            if start is None:
+                start = i
+            if instr['op'] in TERMINATORS:
+                yield start, i + 1
+                start = None
+        else:
+            # A label ends the current block and starts a new one.
+            if start is not None:
+                yield start, i
+            start = i
+    if start is not None:
+        yield start, len(instrs)
+
+
+def block_names(labels):
+    """Name blocks, given each one's label or None if it's anonymous.
+
+    Labeled blocks keep their labels, and anonymous blocks get names like
+    `util.fresh` would give them: the first unused one of `b1`, `b2`, and
+    so on, resuming where the last name left off, since every name before
+    it is already taken.
+    """
+    names = []
+    taken = set()
+    counter = 0
+    for label in labels:
+        if label is None:
+            counter += 1
+            while 'b' + str(counter) in taken:
+                counter += 1
+            label = 'b' + str(counter)
+        names.append(label)
+        taken.add(label)
+    return names
+
+
+def csr(count, pairs):
+    """Build CSR arrays for a graph with `count` nodes from a list of
+    (source, destination) pairs, keeping the pairs' order within each
+    node's row. Returns the row start offsets (with a final entry for the
+    end) and the destinations.
+    """
+    start = array('l', [0]) * (count + 1)
+    for src, _ in pairs:
+        start[src + 1] += 1
+    for i in range(count):
+        start[i + 1] += start[i]
+    dests = array('l', [0]) * len(pairs)
+    fill = array('l', start)
+    for src, dest in pairs:
+        dests[fill[src]] = dest
+        fill[src] += 1
+    return start, dests
+
+
+class Graph:
+    """A directed graph on the nodes `0` to `n - 1`, with its edges in
+    CSR form. `edges` is a list of `(src, dest)` pairs, and the edges out
+    of each node keep their order in it.
+    """
+    def __init__(self, n, edges):
+        self.n = n
+        self.succ_start, self.succ = csr(n, edges)
+        self.pred_start, self.pred = csr(n, [(d, s) for s, d in edges])
+
+    def successors(self, b):
+        return self.succ[self.succ_start[b]:self.succ_start[b + 1]]
+
+    def predecessors(self, b):
+        return self.pred[self.pred_start[b]:self.pred_start[b + 1]]
+
+    def postorder(self, entry=0):
+        """List the nodes reachable from `entry` in postorder, visiting
+        successors in order.
+        """
+        if not self.n:
+            return array('l')
+        out = array('l')
+        seen = bytearray(self.n)
+        seen[entry] = 1
+        stack = [(entry, self.succ_start[entry])]
+        while stack:
+            b, i = stack[-1]
+            if i < self.succ_start[b + 1]:
+                stack[-1] = (b, i + 1)
+                s = self.succ[i]
+                if not seen[s]:
+                    seen[s] = 1
+                    stack.append((s, self.succ_start[s]))
+            else:
+                stack.pop()
+                out.append(b)
+        return out
+
+    def idoms(self, entry=0):
+        """Find the immediate dominator of each node, with the algorithm
+        of Cooper, Harvey, and Kennedy. The entry is its own immediate
+        dominator, and unreachable nodes get -1.
+        """
+        order = self.postorder(entry)
+        number = array('l', [-1]) * self.n
+        for i, b in enumerate(order):
+            number[b] = i
+        idom = array('l', [-1]) * self.n
+        if not self.n:
+            return idom
+        idom[entry] = entry
+
+        changed = True
+        while changed:
+            changed = False
+            for b in reversed(order):
+                if b == entry:
+                    continue
+                new = -1
+                for p in self.predecessors(b):
+                    if idom[p] == -1:
+                        continue
+                    if new == -1:
+                        new = p
+                        continue
+                    # Walk up the dominator tree to the common ancestor.
+                    x, y = p, new
+                    while x != y:
+                        while number[x] < number[y]:
+                            x = idom[x]
+                        while number[y] < number[x]:
+                            y = idom[y]
+                    new = x
+                if idom[b] != new:
+                    idom[b] = new
+                    changed = True
+        return idom
+
+
+class CFG(Graph):
+    """The basic blocks of a list of Bril instructions and the control
+    flow edges between them.
+
+    Blocks are split by `block_ranges`, so block `b` is
+    `instrs[starts[b]:ends[b]]` (including its label, if any). A block
+    that does not end in a terminator falls through to the next block,
+    or exits if it is the last one. `labels[b]` is the block's label, or
+    None for an anonymous block, and `index` maps labels to block numbers.
+    """
+    def __init__(self, instrs):
+        self.instrs = instrs
+        self.starts = array('l')
+        self.ends = array('l')
+        self.labels = []
+
+        # Find the blocks in one pass over the instructions.
+        for start, end in block_ranges(instrs):
+            self.starts.append(start)
+            self.ends.append(end)
+            first = instrs[start]
+            self.labels.append(first['label'] if 'label' in first else None)
+
+        self.index = {label: b for b, label in enumerate(self.labels)
+                      if label is not None}
+
+        # Find the edges out of each block.
+        n = len(self.starts)
+        edges = []
+        for b in range(n):
+            last = instrs[self.ends[b] - 1]
+            op = last.get('op')
+            if op in ('jmp', 'br'):
+                for label in last['labels']:
+                    try:
+                        edges.append((b, self.index[label]))
+                    except KeyError:
+                        raise ValueError('unknown label {}'.format(label))
+            elif op != 'ret' and b + 1 < n:
+                edges.append((b, b + 1))
+        super().__init__(n, edges)
+
+    @classmethod
+    def from_function(cls, func):
+        return cls(func['instrs'])
+
+    def block(self, b):
+        """Get the instructions in a block, including its label.
+        """
+        return self.instrs[self.starts[b]:self.ends[b]]
+
+    def body(self, b):
+        """Get the instructions in a block, without its label.
+        """
+        start = self.starts[b] + (self.labels[b] is not None)
+        return self.instrs[start:self.ends[b]]
+
+    def names(self):
+        """Name each block with `block_names`.
+        """
+        return block_names(self.labels)
+
+
+def block_map(cfg):
+    """Get the same `OrderedDict` of block names to instruction lists as
+    `cfg.block_map(form_blocks(instrs))`.
+    """
+    return OrderedDict(zip(cfg.names(), map(cfg.body, range(cfg.n))))
+
+
+def edges(cfg):
+    """Get the same predecessor and successor dicts as `cfg.edges` on a
+    block map with terminators added.
+    """
+    names = cfg.names()
+    preds = {names[b]: [names[p] for p in cfg.predecessors(b)]
+             for b in range(cfg.n)}
+    succs = {names[b]: [names[s] for s in cfg.successors(b)]
+             for b in range(cfg.n)}
+    return preds, succs
+
+
+def labeled_blocks(cfg):
+    """Get a list of (label, instructions) pairs for the blocks, where
+    the instructions exclude the label and anonymous blocks get None.
+    """
+    return [(cfg.labels[b], cfg.body(b)) for b in range(cfg.n)]
+
+
+def print_cfg(bril):
+    """Print each function's blocks and edges, by number.
+    """
+    for func in bril['functions']:
+        cfg = CFG.from_function(func)
+        print('{}:'.format(func['name']))
+        for b in range(cfg.n):
+            print('  {} {}: {} instrs -> {}'.format(
+                b, cfg.labels[b] or '', cfg.ends[b] - cfg.starts[b],
+                ' '.join(map(str, cfg.successors(b))),
+            ))
+
+
+if __name__ == '__main__':
+    print_cfg(json.load(sys.stdin))
@@ -1,6 +1,7 @@
 from collections import OrderedDict
-from util import fresh, flatten
-from form_blocks import TERMINATORS
+from util import fresh
+import array_cfg
+from array_cfg import TERMINATORS
 
 
 def block_map(blocks):
@@ -9,26 +10,15 @@ def block_map(blocks):
 
     The name of the block comes from the label it starts with, if any.
     Anonymous blocks, which don't start with a label, get an
-    automatically generated name. Blocks in the mapping have their
-    labels removed.
+    automatically generated name (see `array_cfg.block_names`). Blocks
+    in the mapping have their labels removed.
     """
-    by_name = OrderedDict()
-
-    for block in blocks:
-        # Generate a name for the block.
-        if 'label' in block[0]:
-            # The block has a label. Remove the label but use it for the
-            # block's name.
-            name = block[0]['label']
-            block = block[1:]
-        else:
-            # Make up a new name for this anonymous block.
-            name = fresh('b', by_name)
-
-        # Add the block to the mapping.
-        by_name[name] = block
-
-    return by_name
+    blocks = list(blocks)
+    names = array_cfg.block_names([block[0].get('label') for block in blocks])
+    return OrderedDict(
+        (name, block[1:] if 'label' in block[0] else block)
+        for name, block in zip(names, blocks)
+    )
 
 
 def successors(instr):
@@ -49,21 +39,15 @@ def add_terminators(blocks):
     """Given an ordered block map, modify the blocks to add terminators
     to all blocks (avoiding "fall-through" control flow transfers).
     """
+    names = list(blocks.keys())
     for i, block in enumerate(blocks.values()):
-        if not block:
+        if not block or block[-1]['op'] not in TERMINATORS:
             if i == len(blocks) - 1:
                 # In the last block, return.
                 block.append({'op': 'ret', 'args': []})
-            else:
-                dest = list(blocks.keys())[i + 1]
-                block.append({'op': 'jmp', 'labels': [dest]})
-        elif block[-1]['op'] not in TERMINATORS:
-            if i == len(blocks) - 1:
-                block.append({'op': 'ret', 'args': []})
             else:
                 # Otherwise, jump to the next block.
-                dest = list(blocks.keys())[i + 1]
-                block.append({'op': 'jmp', 'labels': [dest]})
+                block.append({'op': 'jmp', 'labels': [names[i + 1]]})
 
 
 def add_entry(blocks):
@@ -76,10 +60,8 @@ def add_entry(blocks):
     first_lbl = next(iter(blocks.keys()))
 
     # Check for any references to the label.
-    for instr in flatten(blocks.values()):
-        if 'labels' in instr and first_lbl in instr['labels']:
-            break
-    else:
+    if not any('labels' in instr and first_lbl in instr['labels']
+               for block in blocks.values() for instr in block):
         return
 
     # References exist; insert a new block.
@@ -93,13 +75,36 @@ def edges(blocks):
     generate two mappings: predecessors and successors. Both map block
     names to lists of block names.
     """
-    preds = {name: [] for name in blocks}
-    succs = {name: [] for name in blocks}
-    for name, block in blocks.items():
-        for succ in successors(block[-1]):
-            succs[name].append(succ)
-            preds[succ].append(name)
-    return preds, succs
+    return array_cfg.edges(array_cfg.CFG(reassemble(blocks)))
+
+
+def form_cfg(instrs, entry=False):
+    """Build a CFG from a list of instructions, in time linear in their
+    number.
+
+    Produces the same block map as `block_map(form_blocks(instrs))`
+    followed by `add_terminators` (and `add_entry` first, if `entry` is
+    set), along with the predecessor and successor maps from `edges`,
+    but builds them all from a single `array_cfg.CFG`. The separate
+    functions are still around for code that needs to do something
+    between the steps.
+    """
+    graph = array_cfg.CFG(instrs)
+    blocks = array_cfg.block_map(graph)
+    preds, succs = array_cfg.edges(graph)
+
+    # Add an entry block if anything jumps to the first block.
+    if entry and blocks:
+        first = next(iter(blocks))
+        add_entry(blocks)
+        new = next(iter(blocks))
+        if new != first:
+            preds[first].insert(0, new)
+            preds = {new: [], **preds}
+            succs = {new: [first], **succs}
+
+    add_terminators(blocks)
+    return blocks, preds, succs
 
 
 def reassemble(blocks):
@@ -0,0 +1,157 @@
+"""Performance measurements for building control flow graphs.
+
+Give some block counts, like this:
+
+    $ python3 cfg_bench.py 1000 10000 100000
+
+Each count gets a synthetic function with that many basic blocks. Results
+are written to standard output as CSV, and a short summary goes to
+standard error.
+
+The `before` column times the steps from `cfg` as they were before
+`form_cfg` existed, copied below, which take quadratic time. They are
+skipped (leaving the cell empty) above `BEFORE_LIMIT` blocks.
+"""
+
+import csv
+import random
+import sys
+import time
+from collections import OrderedDict
+
+import array_cfg
+import cfg
+from form_blocks import form_blocks
+from util import flatten, fresh
+
+# The most blocks to time the old, quadratic steps on.
+BEFORE_LIMIT = 30000
+
+
+def synthetic(blocks, seed=0):
+    """Make a function with about `blocks` basic blocks, mixing labeled
+    and anonymous blocks, branches, jumps, returns, and fall-through, with
+    a loop back to the first block so that it needs an entry block.
+    """
+    rng = random.Random(seed)
+    labels = ['l{}'.format(i) for i in range(blocks)]
+    targets = [label for i, label in enumerate(labels) if i % 4 != 3]
+    instrs = []
+    for i, label in enumerate(labels):
+        if i % 4 != 3:
+            instrs.append({'label': label})
+        instrs.append({'op': 'const', 'dest': 'x', 'type': 'int',
+                       'value': i})
+        kind = rng.random()
+        if kind < 0.4:
+            instrs.append({'op': 'br', 'args': ['c'],
+                           'labels': [rng.choice(targets),
+                                      rng.choice(targets)]})
+        elif kind < 0.6:
+            instrs.append({'op': 'jmp', 'labels': [rng.choice(targets)]})
+        elif kind < 0.65:
+            instrs.append({'op': 'ret', 'args': []})
+    instrs.append({'op': 'jmp', 'labels': [labels[0]]})
+    return {'name': 'main', 'instrs': instrs}
+
+
+def before_block_map(blocks):
+    by_name = OrderedDict()
+    for block in blocks:
+        if 'label' in block[0]:
+            name = block[0]['label']
+            block = block[1:]
+        else:
+            name = fresh('b', by_name)
+        by_name[name] = block
+    return by_name
+
+
+def before_add_terminators(blocks):
+    for i, block in enumerate(blocks.values()):
+        if not block or block[-1]['op'] not in array_cfg.TERMINATORS:
+            if i == len(blocks) - 1:
+                block.append({'op': 'ret', 'args': []})
+            else:
+                dest = list(blocks.keys())[i + 1]
+                block.append({'op': 'jmp', 'labels': [dest]})
+
+
+def before_add_entry(blocks):
+    first_lbl = next(iter(blocks.keys()))
+    for instr in flatten(blocks.values()):
+        if 'labels' in instr and first_lbl in instr['labels']:
+            break
+    else:
+        return
+    new_lbl = fresh('entry', blocks)
+    blocks[new_lbl] = []
+    blocks.move_to_end(new_lbl, last=False)
+
+
+def before_edges(blocks):
+    preds = {name: [] for name in blocks}
+    succs = {name: [] for name in blocks}
+    for name, block in blocks.items():
+        for succ in cfg.successors(block[-1]):
+            succs[name].append(succ)
+            preds[succ].append(name)
+    return preds, succs
+
+
+def before(instrs):
+    """Build the CFG with the steps from `cfg` as they used to be.
+    """
+    blocks = before_block_map(form_blocks(instrs))
+    before_add_entry(blocks)
+    before_add_terminators(blocks)
+    preds, succs = before_edges(blocks)
+    return blocks, preds, succs
+
+
+def separate(instrs):
+    """Build the CFG with the separate steps from `cfg`.
+    """
+    blocks = cfg.block_map(form_blocks(instrs))
+    cfg.add_entry(blocks)
+    cfg.add_terminators(blocks)
+    preds, succs = cfg.edges(blocks)
+    return blocks, preds, succs
+
+
+METHODS = {
+    'before': before,
+    'separate': separate,
+    'form_cfg': lambda instrs: cfg.form_cfg(instrs, entry=True),
+    'array_cfg': array_cfg.CFG,
+}
+
+
+def timed(func, *args):
+    """Call `func` and return the elapsed wall-clock time in seconds.
+    """
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def bench(counts):
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['blocks', 'instrs'] + list(METHODS))
+
+    for count in counts:
+        instrs = synthetic(count)['instrs']
+        times = [
+            None if method is before and count > BEFORE_LIMIT
+            else timed(method, instrs)
+            for method in METHODS.values()
+        ]
+        writer.writerow([count, len(instrs)] + times)
+        print('{} blocks: {}'.format(count, ', '.join(
+            '{} {:.3f} s'.format(name, t)
+            for name, t in zip(METHODS, times) if t is not None
+        )), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    bench([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000])
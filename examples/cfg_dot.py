@@ -2,10 +2,9 @@
 emit a GraphViz file.
 """
 
-from form_blocks import form_blocks
 import json
 import sys
-from cfg import block_map, successors, add_terminators
+from cfg import form_cfg
 
 def cfg_dot(bril, verbose):
     """Generate a GraphViz "dot" file showing the control flow graph for
@@ -16,10 +15,9 @@ def cfg_dot(bril, verbose):
     for func in bril['functions']:
         print('digraph {} {{'.format(func['name']))
 
-        blocks = block_map(form_blocks(func['instrs']))
-
-        # Insert terminators into blocks that don't have them.
-        add_terminators(blocks)
+        # Form the CFG, inserting terminators into blocks that don't
+        # have them.
+        blocks, _, succs = form_cfg(func['instrs'])
 
         # Add the vertices.
         for name, block in blocks.items():
@@ -34,8 +32,7 @@ def cfg_dot(bril, verbose):
                 print('  {};'.format(name))
 
         # Add the control-flow edges.
-        for i, (name, block) in enumerate(blocks.items()):
-            succ = successors(block[-1])
+        for name, succ in succs.items():
             for label in succ:
                 print('  {} -> {};'.format(quote_if_needed(name), quote_if_needed(label)))
 
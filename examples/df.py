@@ -2,7 +2,6 @@ import sys
 import json
 from collections import namedtuple
 
-from form_blocks import form_blocks
 import cfg
 
 # A single dataflow analysis consists of these part:
@@ -82,8 +81,7 @@ def fmt(val):
 def run_df(bril, analysis):
     for func in bril['functions']:
         # Form the CFG.
-        blocks = cfg.block_map(form_blocks(func['instrs']))
-        cfg.add_terminators(blocks)
+        blocks, _, _ = cfg.form_cfg(func['instrs'])
 
         in_, out = df_worklist(blocks, analysis)
         for block in blocks:
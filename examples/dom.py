@@ -1,8 +1,8 @@
 import json
 import sys
 
-from cfg import block_map, successors, add_terminators, add_entry
-from form_blocks import form_blocks
+from array_cfg import Graph
+from cfg import form_cfg
 
 
 def map_inv(succ):
@@ -18,56 +18,30 @@ def map_inv(succ):
     return out
 
 
-def postorder_helper(succ, root, explored, out):
-    """Given a successor edge map, produce a list of all the nodes in
-    the graph in postorder by appending to the `out` list.
-    """
-    if root in explored:
-        return
-    explored.add(root)
-
-    for s in succ[root]:
-        postorder_helper(succ, s, explored, out)
-    out.append(root)
-
-
-def postorder(succ, root):
-    out = []
-    postorder_helper(succ, root, set(), out)
-    return out
-
-
-def intersect(sets):
-    sets = list(sets)
-    if not sets:
-        return set()
-    out = set(sets[0])
-    for s in sets[1:]:
-        out &= s
-    return out
-
-
 def get_dom(succ, entry):
-    pred = map_inv(succ)
-    nodes = list(reversed(postorder(succ, entry)))  # Reverse postorder.
-
-    dom = {v: set(nodes) for v in succ}
+    """Find the dominators of every node in a successor edge map.
 
-    while True:
-        changed = False
-
-        for node in nodes:
-            new_dom = intersect(dom[p] for p in pred[node])
-            new_dom.add(node)
-
-            if dom[node] != new_dom:
-                dom[node] = new_dom
-                changed = True
+    This numbers the nodes and uses the immediate dominators from
+    `array_cfg`, then collects each node's dominators by walking up the
+    dominator tree. Unreachable nodes are dominated by every reachable
+    node.
+    """
+    names = list(succ)
+    index = {name: i for i, name in enumerate(names)}
+    graph = Graph(len(names), [(index[a], index[b])
+                               for a in names for b in succ[a]])
+    start = index[entry]
+    idom = graph.idoms(start)
 
-        if not changed:
-            break
+    # In reverse postorder, a node's immediate dominator comes before it.
+    reachable = {}
+    for b in reversed(graph.postorder(start)):
+        name = names[b]
+        up = set() if b == start else reachable[names[idom[b]]]
+        reachable[name] = up | {name}
 
-    return dom
+    return {v: reachable[v] if v in reachable else set(reachable)
+            for v in succ}
 
 
 def dom_fronts(dom, succ):
@@ -106,10 +80,7 @@ def dom_tree(dom):
 
 def print_dom(bril, mode):
     for func in bril['functions']:
-        blocks = block_map(form_blocks(func['instrs']))
-        add_entry(blocks)
-        add_terminators(blocks)
-        succ = {name: successors(block[-1]) for name, block in blocks.items()}
+        blocks, _, succ = form_cfg(func['instrs'], entry=True)
         dom = get_dom(succ, list(blocks.keys())[0])
 
         if mode == 'front':
@@ -4,8 +4,8 @@
 import json
 import sys
 
-# Instructions that terminate a basic block.
-TERMINATORS = 'br', 'jmp', 'ret'
+# TERMINATORS used to live here; keep importing it from this module working.
+from array_cfg import TERMINATORS, block_ranges  # noqa: F401
 
 
 def form_blocks(instrs):
@@ -17,34 +17,12 @@ def form_blocks(instrs):
     control can transfer only to the top of a basic block---so labels
     can only appear at the *start* of a basic block. Basic blocks may
     not be empty.
-    """
-
-    # Start with an empty block.
-    cur_block = []
-
-    for instr in instrs:
-        if 'op' in instr:  # It's an instruction.
-            # Add the instruction to the currently-being-formed block.
-            cur_block.append(instr)
-
-            # If this is a terminator (branching instruction), it's the
-            # last instruction in the block. Finish this block and
-            # start a new one.
-            if instr['op'] in TERMINATORS:
-                yield cur_block
-                cur_block = []
 
-        else:  # It's a label.
-            # End the block here (if it contains anything).
-            if cur_block:
-                yield cur_block
-
-            # Start a new block with the label.
-            cur_block = [instr]
-
-    # Produce the final block, if any.
-    if cur_block:
-        yield cur_block
+    The blocks are the ones that `array_cfg.block_ranges` finds, so they
+    match the blocks of an `array_cfg.CFG`.
+    """
+    for start, end in block_ranges(instrs):
+        yield instrs[start:end]
 
 
 def print_blocks(bril):
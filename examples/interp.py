@@ -0,0 +1,646 @@
+"""A Bril interpreter in Python, for running programs without leaving the
+process that transformed them.
+
+It behaves like `brili`, including the dynamic instruction count that
+`brili -p` reports, so you can use it to check an optimization over a
+whole benchmark suite at once:
+
+    prog = Program(json.load(f))
+    out = io.StringIO()
+    count = prog.run(['10'], out)
+
+Each function is decoded once, up front, into a list of small closures
+(one per instruction, built from the `DECODERS` dispatch table) with
+labels resolved to indices, so running a program is just a loop that
+calls them in turn. Unlike `brili`, it does not check the types of
+values, so type errors in ill-typed programs go undiagnosed; use `brilck`
+for those.
+
+As a command, it takes a JSON program on stdin and arguments for `main`,
+just like `brili`:
+
+    $ bril2json < prog.bril | python3 interp.py -p 10
+"""
+import json
+import math
+import operator
+import struct
+import sys
+
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+
+# Special values returned by decoded instructions, besides None (go on to
+# the next instruction) and nonnegative jump targets. A failed guard
+# returns `ABORT - target`.
+END = -1
+SPECULATE = -2
+COMMIT = -3
+ABORT = -4
+
+# Keys for the return value and the "shadow" variables of `set` and `get`,
+# kept in the environment itself so instructions need only that.
+RETURN = object()
+SHADOW = object()
+
+UNDEF = object()
+
+
+class BrilError(Exception):
+    """An error in the program being interpreted.
+    """
+
+
+def wrap(value):
+    """Wrap an integer around to 64 bits, like `BigInt.asIntN(64, ...)`.
+    """
+    return (value - INT_MIN) % 2 ** 64 + INT_MIN
+
+
+def int_div(a, b):
+    """Divide integers, rounding toward zero.
+    """
+    if b == 0:
+        raise BrilError('division by zero')
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+def float_div(a, b):
+    """Divide floats, with JavaScript's results for division by zero.
+    """
+    try:
+        return a / b
+    except ZeroDivisionError:
+        if a == 0 or math.isnan(a):
+            return math.nan
+        return math.copysign(math.inf, a) * math.copysign(1.0, b)
+
+
+def show(value):
+    """Format a value the way `brili` prints it.
+    """
+    if value is UNDEF:
+        raise BrilError('print of undefined value')
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if type(value) is float:
+        if math.isnan(value):
+            return 'NaN'
+        if math.isinf(value):
+            return 'Infinity' if value > 0 else '-Infinity'
+        if value != 0 and abs(math.log10(abs(value))) >= 10:
+            # JavaScript writes exponents without leading zeros.
+            mantissa, exp = '{:.17e}'.format(value).split('e')
+            return '{}e{}{}'.format(mantissa, exp[0], int(exp[1:]))
+        return '{:.17f}'.format(value)
+    return str(value)
+
+
+def check_args(instr, count):
+    found = len(instr.get('args', []))
+    if found != count:
+        raise BrilError('{} takes {} argument(s); got {}'.format(
+            instr['op'], count, found,
+        ))
+    return instr.get('args', [])
+
+
+def labels(instr, targets, count):
+    """Get the instruction indices for the labels of a jump or branch.
+    """
+    names = instr.get('labels', [])
+    if len(names) < count:
+        raise BrilError('expecting {} labels; found {}'.format(
+            count, len(names),
+        ))
+    for name in names[:count]:
+        if name not in targets:
+            raise BrilError('label {} not found'.format(name))
+    return [targets[name] for name in names[:count]]
+
+
+def wrapping(func):
+    """Decode an integer arithmetic instruction.
+    """
+    def decode(instr, targets, prog):
+        a, b = check_args(instr, 2)
+        dest = instr['dest']
+
+        def step(env):
+            value = func(env[a], env[b])
+            env[dest] = value if INT_MIN <= value <= INT_MAX else \
+                wrap(value)
+        return step
+    return decode
+
+
+def binary(func):
+    """Decode an instruction that applies `func` to its two arguments.
+    """
+    def decode(instr, targets, prog):
+        a, b = check_args(instr, 2)
+        dest = instr['dest']
+
+        def step(env):
+            env[dest] = func(env[a], env[b])
+        return step
+    return decode
+
+
+def unary(func):
+    """Decode an instruction that applies `func` to its one argument.
+    """
+    def decode(instr, targets, prog):
+        a, = check_args(instr, 1)
+        dest = instr['dest']
+
+        def step(env):
+            env[dest] = func(env[a])
+        return step
+    return decode
+
+
+def decode_const(instr, targets, prog):
+    value = instr['value']
+    if instr['type'] == 'float':
+        value = float(value)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        value = math.floor(value)
+    elif isinstance(value, str) and len(value) != 1:
+        raise BrilError('char must have one character')
+    dest = instr['dest']
+
+    def step(env):
+        env[dest] = value
+    return step
+
+
+def decode_print(instr, targets, prog):
+    args = instr.get('args', [])
+
+    def step(env):
+        prog.write(' '.join([show(env[a]) for a in args]) + '\n')
+    return step
+
+
+def decode_jmp(instr, targets, prog):
+    target, = labels(instr, targets, 1)
+    return lambda env: target
+
+
+def decode_br(instr, targets, prog):
+    cond, = check_args(instr, 1)
+    then, els = labels(instr, targets, 2)
+    return lambda env: then if env[cond] else els
+
+
+def decode_ret(instr, targets, prog):
+    args = instr.get('args', [])
+    if len(args) > 1:
+        raise BrilError('ret takes 0 or 1 argument(s); got {}'.format(
+            len(args),
+        ))
+    if not args:
+        return lambda env: END
+    a, = args
+
+    def step(env):
+        env[RETURN] = env[a]
+        return END
+    return step
+
+
+def decode_call(instr, targets, prog):
+    funcs = instr.get('funcs')
+    if not funcs:
+        raise BrilError('missing functions; expected at least 1')
+    name = funcs[0]
+    args = instr.get('args', [])
+    dest = instr.get('dest')
+    call = prog.call
+
+    def step(env):
+        value = call(name, [env[a] for a in args])
+        if value is not None:
+            if dest is None:
+                raise BrilError(
+                    'unexpected value returned without destination'
+                )
+            env[dest] = value
+            return
+        typ = prog.funcs[name].type
+        if dest is not None or typ is not None:
+            raise BrilError('non-void function (type: {}) doesn\'t return '
+                            'anything'.format(typ))
+    return step
+
+
+def decode_alloc(instr, targets, prog):
+    a, = check_args(instr, 1)
+    dest = instr['dest']
+    heap = prog.heap
+
+    def step(env):
+        amount = env[a]
+        if amount <= 0:
+            raise BrilError('must allocate a positive amount of memory: '
+                            '{} <= 0'.format(amount))
+        base = prog.allocs
+        prog.allocs += 1
+        heap[base] = [None] * amount
+        env[dest] = (base, 0)
+    return step
+
+
+def decode_free(instr, targets, prog):
+    a, = check_args(instr, 1)
+    heap = prog.heap
+
+    def step(env):
+        base, offset = env[a]
+        if base not in heap or offset != 0:
+            raise BrilError('Tried to free illegal memory location base: '
+                            '{}, offset: {}. Offset must be 0.'.format(
+                                base, offset))
+        del heap[base]
+    return step
+
+
+def heap_data(heap, pointer):
+    """Get the list of values behind a pointer, checking that its offset
+    is in bounds.
+    """
+    base, offset = pointer
+    data = heap.get(base)
+    if data is None or not 0 <= offset < len(data):
+        raise BrilError('Uninitialized heap location {} and/or illegal '
+                        'offset {}'.format(base, offset))
+    return data
+
+
+def decode_store(instr, targets, prog):
+    ptr, a = check_args(instr, 2)
+    heap = prog.heap
+
+    def step(env):
+        pointer = env[ptr]
+        heap_data(heap, pointer)[pointer[1]] = env[a]
+    return step
+
+
+def decode_load(instr, targets, prog):
+    ptr, = check_args(instr, 1)
+    dest = instr['dest']
+    heap = prog.heap
+
+    def step(env):
+        pointer = env[ptr]
+        value = heap_data(heap, pointer)[pointer[1]]
+        if value is None:
+            raise BrilError('Pointer {} points to uninitialized '
+                            'data'.format(ptr))
+        env[dest] = value
+    return step
+
+
+def decode_ptradd(instr, targets, prog):
+    ptr, a = check_args(instr, 2)
+    dest = instr['dest']
+
+    def step(env):
+        base, offset = env[ptr]
+        env[dest] = (base, offset + env[a])
+    return step
+
+
+def decode_set(instr, targets, prog):
+    shadow, a = check_args(instr, 2)
+
+    def step(env):
+        env[SHADOW][shadow] = env[a]
+    return step
+
+
+def decode_get(instr, targets, prog):
+    check_args(instr, 0)
+    dest = instr['dest']
+
+    def step(env):
+        try:
+            env[dest] = env[SHADOW].pop(dest)
+        except KeyError:
+            raise BrilError('get without corresponding set for '
+                            '{}'.format(dest))
+    return step
+
+
+def decode_undef(instr, targets, prog):
+    dest = instr['dest']
+
+    def step(env):
+        env[dest] = UNDEF
+    return step
+
+
+def decode_guard(instr, targets, prog):
+    cond, = check_args(instr, 1)
+    target, = labels(instr, targets, 1)
+    abort = ABORT - target
+    return lambda env: None if env[cond] else abort
+
+
+def bits2float(value):
+    return struct.unpack('<d', struct.pack('<q', value))[0]
+
+
+def float2bits(value):
+    return struct.unpack('<q', struct.pack('<d', value))[0]
+
+
+def int2char(value):
+    if not 0 <= value <= 0x10ffff or 0xd7ff < value < 0xe000:
+        raise BrilError('value {} cannot be converted to char'.format(value))
+    return chr(value)
+
+
+# How to decode each opcode. A decoder takes the instruction, a dict mapping
+# labels to instruction indices, and the `Program`, and returns a function
+# that executes the instruction in an environment.
+DECODERS = {
+    'const': decode_const,
+    'id': unary(lambda x: x),
+    'add': wrapping(operator.add),
+    'mul': wrapping(operator.mul),
+    'sub': wrapping(operator.sub),
+    'div': wrapping(int_div),
+    'eq': binary(operator.eq),
+    'lt': binary(operator.lt),
+    'gt': binary(operator.gt),
+    'le': binary(operator.le),
+    'ge': binary(operator.ge),
+    'not': unary(operator.not_),
+    'and': binary(operator.and_),
+    'or': binary(operator.or_),
+    'fadd': binary(operator.add),
+    'fmul': binary(operator.mul),
+    'fsub': binary(operator.sub),
+    'fdiv': binary(float_div),
+    'feq': binary(operator.eq),
+    'flt': binary(operator.lt),
+    'fgt': binary(operator.gt),
+    'fle': binary(operator.le),
+    'fge': binary(operator.ge),
+    'print': decode_print,
+    'jmp': decode_jmp,
+    'br': decode_br,
+    'ret': decode_ret,
+    'nop': lambda instr, targets, prog: lambda env: None,
+    'call': decode_call,
+    'alloc': decode_alloc,
+    'free': decode_free,
+    'store': decode_store,
+    'load': decode_load,
+    'ptradd': decode_ptradd,
+    'set': decode_set,
+    'get': decode_get,
+    'undef': decode_undef,
+    'speculate': lambda instr, targets, prog: lambda env: SPECULATE,
+    'guard': decode_guard,
+    'commit': lambda instr, targets, prog: lambda env: COMMIT,
+    'ceq': binary(operator.eq),
+    'clt': binary(operator.lt),
+    'cle': binary(operator.le),
+    'cgt': binary(operator.gt),
+    'cge': binary(operator.ge),
+    'char2int': unary(ord),
+    'int2char': unary(int2char),
+    'bits2float': unary(bits2float),
+    'float2bits': unary(float2bits),
+}
+
+
+# The type of every argument to each opcode, where they all have one type,
+# for reporting operations on undefined values like `brili` does.
+ARG_TYPES = dict(
+    [(op, 'int') for op in ('add', 'mul', 'sub', 'div', 'eq', 'lt', 'gt',
+                            'le', 'ge', 'int2char', 'bits2float')] +
+    [(op, 'bool') for op in ('not', 'and', 'or', 'br', 'guard')] +
+    [(op, 'float') for op in ('fadd', 'fmul', 'fsub', 'fdiv', 'feq', 'flt',
+                              'fgt', 'fle', 'fge', 'float2bits')] +
+    [(op, 'char') for op in ('ceq', 'clt', 'cle', 'cgt', 'cge',
+                             'char2int')]
+)
+
+
+def type_error(instr, env):
+    """Describe a `TypeError` raised while running `instr`. Values are not
+    checked, so this only recognizes undefined arguments.
+    """
+    typ = ARG_TYPES.get(instr['op'])
+    for i, arg in enumerate(instr.get('args', [])):
+        if typ and env.get(arg) is UNDEF:
+            return BrilError('{} argument {} must be a {}'.format(
+                instr['op'], i, typ,
+            ))
+    return BrilError('type error (perhaps an undefined value?)')
+
+
+def failing(error):
+    """Make an instruction that raises an error when it runs, for errors
+    found while decoding (which `brili` would only report when the
+    instruction runs).
+    """
+    def step(env):
+        raise error
+    return step
+
+
+def parse_arg(arg, typ):
+    """Parse a command-line argument for `main`.
+    """
+    try:
+        if typ == 'int':
+            try:
+                return int(arg)
+            except ValueError:
+                return int(float(arg))
+        elif typ == 'float':
+            value = float(arg)
+            if not math.isnan(value):
+                return value
+        elif typ == 'bool' and arg in ('true', 'false'):
+            return arg == 'true'
+        elif typ == 'char' and len(arg) == 1:
+            return arg
+    except ValueError:
+        pass
+    raise BrilError('bad {} argument to main: {}'.format(typ, arg))
+
+
+class Function:
+    """A decoded Bril function.
+    """
+    def __init__(self, func, prog):
+        self.name = func['name']
+        self.params = [arg['name'] for arg in func.get('args', [])]
+        self.types = [arg['type'] for arg in func.get('args', [])]
+        self.type = func.get('type')
+
+        # Map each label to the index of the next real instruction.
+        targets = {}
+        count = 0
+        for instr in func['instrs']:
+            if 'label' in instr:
+                targets[instr['label']] = count
+            else:
+                count += 1
+
+        self.instrs = [instr for instr in func['instrs']
+                       if 'label' not in instr]
+        self.code = []
+        for instr in self.instrs:
+            try:
+                decoder = DECODERS.get(instr['op'])
+                if decoder is None:
+                    raise BrilError('unknown opcode {}'.format(instr['op']))
+                self.code.append(decoder(instr, targets, prog))
+            except BrilError as exc:
+                self.code.append(failing(exc))
+
+
+class Program:
+    """A decoded Bril program, ready to run any number of times.
+    """
+    def __init__(self, prog):
+        self.heap = {}
+        self.allocs = 0
+        self.count = 0
+        self.write = None
+        self.speculating = False
+        self.funcs = {}
+        for func in prog['functions']:
+            # Duplicate functions are an error only when called.
+            name = func['name']
+            self.funcs[name] = None if name in self.funcs else \
+                Function(func, self)
+
+    def call(self, name, args):
+        """Call a function with a list of argument values, returning its
+        result (or None).
+        """
+        if self.speculating:
+            raise BrilError('call not allowed during speculation')
+        try:
+            func = self.funcs[name]
+        except KeyError:
+            raise BrilError('no function of name {} found'.format(name))
+        if func is None:
+            raise BrilError('multiple functions of name {} found'.format(
+                name,
+            ))
+        if len(args) != len(func.params):
+            raise BrilError('function expected {} arguments, got {}'.format(
+                len(func.params), len(args),
+            ))
+        env = dict(zip(func.params, args))
+        env[SHADOW] = {}
+
+        code = func.code
+        size = len(code)
+        speculating = []
+        pc = 0
+        count = 0
+        try:
+            while pc < size:
+                action = code[pc](env)
+                count += 1
+                if action is None:
+                    pc += 1
+                elif action >= 0:
+                    pc = action
+                elif action == END:
+                    if speculating:
+                        raise BrilError('ret not allowed during speculation')
+                    break
+                elif action == SPECULATE:
+                    speculating.append(env)
+                    env = dict(env)
+                    self.speculating = True
+                    pc += 1
+                elif action == COMMIT:
+                    if not speculating:
+                        raise BrilError('commit in non-speculative state')
+                    speculating.clear()
+                    self.speculating = False
+                    pc += 1
+                else:
+                    if not speculating:
+                        raise BrilError('abort in non-speculative state')
+                    env = speculating.pop()
+                    self.speculating = bool(speculating)
+                    pc = ABORT - action
+            else:
+                if speculating:
+                    raise BrilError('implicit return in speculative state')
+        except TypeError:
+            raise type_error(func.instrs[pc], env) from None
+        finally:
+            self.count += count
+        return env.get(RETURN)
+
+    def run(self, args=(), out=sys.stdout):
+        """Run `main` with a list of string arguments, writing its output
+        to the file `out`. Returns the number of instructions executed,
+        as counted by `brili -p`, or None if there is no `main` to run
+        (which, as in `brili`, is only a warning).
+        """
+        if 'main' not in self.funcs:
+            print('no main function defined, doing nothing', file=sys.stderr)
+            return None
+        main = self.funcs['main']
+        if main is None:
+            raise BrilError('multiple functions of name main found')
+        if len(args) != len(main.params):
+            raise BrilError('mismatched main argument arity: expected {}; '
+                            'got {}'.format(len(main.params), len(args)))
+        values = [parse_arg(a, t) for a, t in zip(args, main.types)]
+
+        self.heap.clear()
+        self.allocs = 0
+        self.count = 0
+        self.write = out.write
+        self.speculating = False
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, 100000))
+        try:
+            self.call('main', values)
+        except KeyError as exc:
+            raise BrilError('undefined variable {}'.format(exc.args[0]))
+        finally:
+            sys.setrecursionlimit(limit)
+        if self.heap:
+            raise BrilError('Some memory locations have not been freed by '
+                            'end of execution.')
+        return self.count
+
+
+def interp():
+    args = sys.argv[1:]
+    profile = '-p' in args
+    if profile:
+        args.remove('-p')
+    try:
+        count = Program(json.load(sys.stdin)).run(args)
+    except BrilError as exc:
+        sys.stdout.flush()
+        print('error: {}'.format(exc), file=sys.stderr)
+        sys.exit(2)
+    if profile and count is not None:
+        print('total_dyn_inst: {}'.format(count), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    interp()
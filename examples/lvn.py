@@ -276,6 +276,21 @@ def lvn(bril, prop=False, canon=False, fold=False):
         func['instrs'] = flatten(blocks)
 
 
+# The command-line flags for each option of `lvn`.
+FLAGS = {'-p': 'prop', '-c': 'canon', '-f': 'fold'}
+
+
+def lvn_flags(bril, *flags):
+    """Apply `lvn` with options given as command-line flags, like `-p`,
+    for use as a brench Python step. Unlike the command, this rejects
+    words that aren't flags, since they would otherwise be ignored.
+    """
+    unknown = [f for f in flags if f not in FLAGS]
+    if unknown:
+        raise ValueError('unknown lvn flags: {}'.format(' '.join(unknown)))
+    lvn(bril, **{FLAGS[f]: True for f in flags})
+
+
 if __name__ == '__main__':
     bril = json.load(sys.stdin)
     lvn(bril, '-p' in sys.argv, '-c' in sys.argv, '-f' in sys.argv)
@@ -1,6 +1,26 @@
+"""Normalize brench results against a baseline run.
+
+Reads brench's CSV (or the JSON records from `brench --json`) on stdin and
+writes it back out with each result divided by the baseline run's result
+for the same benchmark. Summary statistics for each run go to stderr:
+the geometric mean, minimum, and maximum ratio, a bootstrap confidence
+interval for the geometric mean, and the run's average rank among all the
+runs of each benchmark. Ranks compare the raw results (lower is better,
+and failures come last), so they don't depend on the baseline having
+worked.
+
+Results are handled as whole columns rather than row by row, so large
+sweeps stay fast.
+"""
+import argparse
+import bisect
 import csv
+import itertools
+import json
+import math
+import random
 import sys
-from collections import defaultdict
+from array import array
 from statistics import geometric_mean
 
 STATS = {
@@ -9,36 +29,174 @@ STATS = {
     'max': max,
 }
 
+# Bootstrap resamples have at most this many ratios. For more, an "m out of
+# n" bootstrap estimates the spread from smaller resamples and rescales it.
+MAX_RESAMPLE = 1000
+
+# The fields to use for JSON records.
+RECORD_FIELDS = ['sweep', 'benchmark', 'run', 'result']
+
+
+def read_columns(lines):
+    """Read brench results from an iterator of lines as a list of field
+    names and a dict mapping each one to a column (a list of strings).
+
+    Records from several sweeps get a `sweep` column, so that each sweep
+    is normalized separately.
+    """
+    first = next(lines, '')
+    lines = itertools.chain([first], lines)
+    if first.startswith('{'):
+        records = [json.loads(line) for line in lines if line.strip()]
+        columns = {f: [r[f] for r in records] for f in RECORD_FIELDS}
+        columns['result'] = [
+            r['result'] if r['status'] is None else r['status']
+            for r in records
+        ]
+        return RECORD_FIELDS, columns
+
+    reader = csv.reader(lines)
+    fields = next(reader, [])
+    columns = list(zip(*reader)) or [()] * len(fields)
+    return fields, {f: list(c) for f, c in zip(fields, columns)}
+
+
+def encode(values):
+    """Number the distinct values in a column in order of appearance.
+    Returns an array of the numbers and a list of the distinct values.
+    """
+    values = list(values)
+    distinct = list(dict.fromkeys(values))
+    index = {v: i for i, v in enumerate(distinct)}
+    return array('l', map(index.__getitem__, values)), distinct
+
+
+def to_float(text):
+    """Parse a result, or get NaN for a status like `timeout`.
+    """
+    try:
+        return float(text)
+    except ValueError:
+        return math.nan
+
+
+def ratios(groups, runs, values, baseline):
+    """Divide each value by the baseline run's value in the same group,
+    giving NaN when there is no usable baseline.
+    """
+    base = array('d', [math.nan]) * (max(groups, default=-1) + 1)
+    for g, r, v in zip(groups, runs, values):
+        if r == baseline:
+            base[g] = v
+    return array('d', [
+        v / b if b else math.nan
+        for v, b in zip(values, map(base.__getitem__, groups))
+    ])
+
+
+def ranks(groups, values):
+    """Rank the values within each group, where 1 is the lowest value.
+    Equal values share a rank, and NaN is ranked last.
+    """
+    keys = [math.inf if math.isnan(v) else v for v in values]
+    members = [[] for _ in range(max(groups, default=-1) + 1)]
+    for g, k in zip(groups, keys):
+        members[g].append(k)
+    for m in members:
+        m.sort()
+    return array('l', [
+        1 + bisect.bisect_left(members[g], k)
+        for g, k in zip(groups, keys)
+    ])
+
+
+def bootstrap(logs, resamples, rng, level=0.95):
+    """Get a bootstrap confidence interval for the geometric mean of some
+    ratios, given their logarithms.
+    """
+    n = len(logs)
+    m = min(n, MAX_RESAMPLE)
+    center = math.fsum(logs) / n
+    scale = math.sqrt(m / n)
+    means = sorted(
+        center + (math.fsum(rng.choices(logs, k=m)) / m - center) * scale
+        for _ in range(resamples)
+    )
+    low = means[int((1 - level) / 2 * resamples)]
+    high = means[min(int((1 + level) / 2 * resamples), resamples - 1)]
+    return math.exp(low), math.exp(high)
+
 
 def normalize():
-    # Read input CSV.
-    reader = csv.DictReader(sys.stdin)
-    in_data = list(reader)
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-b', '--baseline',
+                        help='run to normalize against (default: the run '
+                        'named "baseline", or else the first run)')
+    parser.add_argument('-n', '--bootstrap', type=int, default=1000,
+                        metavar='N', help='resamples for confidence '
+                        'intervals (0 to skip them)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed for bootstrapping')
+    parser.add_argument('-r', '--rank', action='store_true',
+                        help='add a column ranking the runs of each '
+                        'benchmark')
+    args = parser.parse_args()
+
+    # Read input CSV (or records) and encode the key columns.
+    fields, columns = read_columns(iter(sys.stdin))
+    runs, run_names = encode(columns['run'])
+    if 'sweep' in columns:
+        groups, _ = encode(zip(columns['sweep'], columns['benchmark']))
+    else:
+        groups, _ = encode(columns['benchmark'])
+    values = array('d', map(to_float, columns['result']))
 
-    # Get normalization baselines.
-    baselines = {
-        row['benchmark']: int(row['result'])
-        for row in in_data
-        if row['run'] == 'baseline'
-    }
+    # Normalize against the baseline run.
+    baseline = args.baseline
+    if baseline is None:
+        baseline = 'baseline' if 'baseline' in run_names else \
+            next(iter(run_names), None)
+    if baseline not in run_names:
+        parser.error('no results for baseline run {}'.format(baseline))
+    normed = ratios(groups, runs, values, run_names.index(baseline))
 
     # Write output CSV back out.
-    writer = csv.DictWriter(sys.stdout, reader.fieldnames)
-    writer.writeheader()
-    ratios = defaultdict(list)
-    for row in in_data:
-        ratio = int(row['result']) / baselines[row['benchmark']]
-        ratios[row['run']].append(ratio)
-        row['result'] = ratio
-        writer.writerow(row)
+    columns['result'] = [
+        old if math.isnan(r) else r
+        for old, r in zip(columns['result'], normed)
+    ]
+    if args.rank:
+        fields = fields + ['rank']
+        columns['rank'] = ranks(groups, values)
+    writer = csv.writer(sys.stdout)
+    writer.writerow(fields)
+    writer.writerows(zip(*(columns[f] for f in fields)))
 
     # Print stats.
-    for run, rs in ratios.items():
-        for name, func in STATS.items():
+    by_run = [array('d') for _ in run_names]
+    for r, x in zip(runs, normed):
+        if x > 0:
+            by_run[r].append(x)
+    rank_sums = [0] * len(run_names)
+    if args.rank:
+        for r, k in zip(runs, columns['rank']):
+            rank_sums[r] += k
+    rng = random.Random(args.seed)
+    for i, (run, rs) in enumerate(zip(run_names, by_run)):
+        for name, func in STATS.items() if rs else ():
             print(
                 '{}({}) = {:.2f}'.format(name, run, func(rs)),
                 file=sys.stderr,
             )
+        if args.bootstrap and rs:
+            low, high = bootstrap(list(map(math.log, rs)), args.bootstrap,
+                                  rng)
+            print('ci95({}) = [{:.2f}, {:.2f}]'.format(run, low, high),
+                  file=sys.stderr)
+        if args.rank:
+            print('rank({}) = {:.2f}'.format(
+                run, rank_sums[i] / runs.count(i),
+            ), file=sys.stderr)
 
 
 if __name__ == '__main__':
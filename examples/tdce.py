@@ -120,16 +120,18 @@ MODES = {
 }
 
 
-def localopt():
-    if len(sys.argv) > 1:
-        modify_func = MODES[sys.argv[1]]
-    else:
-        modify_func = trivial_dce
-
-    # Apply the change to all the functions in the input program.
-    bril = json.load(sys.stdin)
+def tdce(bril, mode='tdce'):
+    """Apply one of the `MODES` to all the functions in a program, in
+    place.
+    """
+    modify_func = MODES[mode]
     for func in bril['functions']:
         modify_func(func)
+
+
+def localopt():
+    bril = json.load(sys.stdin)
+    tdce(bril, *sys.argv[1:2])
     json.dump(bril, sys.stdout, indent=2, sort_keys=True)
 
 
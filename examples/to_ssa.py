@@ -2,8 +2,7 @@ import json
 import sys
 from collections import defaultdict
 
-from cfg import block_map, successors, add_terminators, add_entry, reassemble
-from form_blocks import form_blocks
+from cfg import form_cfg, reassemble
 from dom import get_dom, dom_fronts, dom_tree
 
 
@@ -138,10 +137,7 @@ def get_types(func):
 
 
 def func_to_ssa(func):
-    blocks = block_map(form_blocks(func["instrs"]))
-    add_entry(blocks)
-    add_terminators(blocks)
-    succ = {name: successors(block[-1]) for name, block in blocks.items()}
+    blocks, _, succ = form_cfg(func["instrs"], entry=True)
     dom = get_dom(succ, list(blocks.keys())[0])
 
     df = dom_fronts(dom, succ)
@@ -1,8 +1,7 @@
 import json
 import sys
 
-from cfg import block_map, successors, add_terminators, add_entry, reassemble
-from form_blocks import form_blocks
+from cfg import form_cfg, reassemble
 
 
 def get_types(func):
@@ -60,10 +59,7 @@ def block_to_ssa(block, block_name, succ_names, var_types):
 
 def func_to_ssa(func):
     # Construct a well-behaved CFG.
-    blocks = block_map(form_blocks(func["instrs"]))
-    add_entry(blocks)
-    add_terminators(blocks)
-    succ = {name: successors(block[-1]) for name, block in blocks.items()}
+    blocks, _, succ = form_cfg(func["instrs"], entry=True)
 
     # Rename all variables within the block and insert set/get.
     var_types = get_types(func)
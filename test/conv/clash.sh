@@ -0,0 +1,8 @@
+# Nothing is converted if two outputs would be the same file or an output
+# would overwrite an input.
+brilconv -o out dup/a/prog.bril dup/b/prog.bril 2>&1
+echo "exit $?"
+brilconv 'clash/*' 2>&1
+echo "exit $?"
+find out clash -type f 2>/dev/null | sort
+rm -rf out
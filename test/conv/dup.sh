@@ -0,0 +1,7 @@
+# Inputs with the same name in different directories keep their paths
+# (relative to where the pattern starts) under the output directory.
+out=$(mktemp -d)
+brilconv -j 2 -o "$out" 'dup/**/*.bril'
+echo "exit $?"
+cd "$out" && find . -type f | sort && cat a/prog.json b/prog.json
+rm -rf "$out"
@@ -0,0 +1,6 @@
+# A negative job count is a usage error, not a crash in the worker pool.
+out=$(brilconv -j -3 dup/a/prog.bril 2>&1)
+status=$?
+echo "$out" | tail -n 1
+echo "exit $status"
+find dup -name '*.json'
@@ -0,0 +1,48 @@
+"""Check incremental re-parsing against full parses.
+
+Reads a Bril text file, parses it with an `IncrementalParser`, then
+applies a series of edits. After each one, it prints how many top-level
+definitions had to be re-parsed and whether the result is the same as
+parsing the edited text from scratch with `parse_bril` (apart from the
+final newline, which only the incremental output has). Use `-p` or
+`--pos-table` to include source positions.
+"""
+import sys
+
+import briltxt
+
+
+def edits(txt):
+    """Generate (name, text) pairs for successive edits of a program:
+    none, a blank line at the top, a new instruction in the first
+    function (moving the rest), and adding and then removing a function.
+    """
+    yield 'initial', txt
+    yield 'unchanged', txt
+    txt = '\n' + txt
+    yield 'shift', txt
+    end = txt.index('}')
+    txt = txt[:end] + '  nop;\n' + txt[end:]
+    yield 'change', txt
+    yield 'add', txt + '@extra {\n  nop;\n}\n'
+    yield 'remove', txt
+
+
+def check(path, include_pos=False, pos_table=False):
+    with open(path) as f:
+        txt = f.read()
+    inc = briltxt.IncrementalParser(include_pos=include_pos,
+                                    pos_table=pos_table)
+    for name, txt in edits(txt):
+        same = inc.parse(txt).rstrip('\n') == briltxt.parse_bril(
+            txt, include_pos=include_pos, pos_table=pos_table,
+        )
+        print('{}: {}/{} reparsed, {}'.format(
+            name, inc.reparsed, inc.total, 'same' if same else 'DIFFERENT',
+        ))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    check(args[-1], include_pos='-p' in args,
+          pos_table='--pos-table' in args)